@@ -6,12 +6,25 @@ from flask_mongoengine import MongoEngine
 from flask_login import LoginManager
 from flask_pagedown import PageDown
 from config import config
+from .cache import DocumentCache, ResponseCache
+from .last_seen import LastSeenTracker
+from .email import MailDispatcher
+from .hashing import PasswordHasher
+from .profiling import Profiler
+from .connection import ReadRouter
 
 bootstrap = Bootstrap()
 mail = Mail()
+mail_dispatcher = MailDispatcher()
 moment = Moment()
 db = MongoEngine()
 pagedown = PageDown()
+user_cache = DocumentCache('user')
+response_cache = ResponseCache()
+last_seen = LastSeenTracker()
+profiler = Profiler()
+password_hasher = PasswordHasher()
+read_router = ReadRouter()
 
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
@@ -25,10 +38,17 @@ def create_app(config_name):
 
     bootstrap.init_app(app)
     mail.init_app(app)
+    mail_dispatcher.init_app(app)
     moment.init_app(app)
+    profiler.init_app(app)
+    read_router.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    user_cache.init_app(app)
+    response_cache.init_app(app)
+    last_seen.init_app(app)
+    password_hasher.init_app(app)
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -36,4 +56,12 @@ def create_app(config_name):
     from .auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix='/auth')
 
+    from .api_v1 import api as api_blueprint
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
+
+    if app.config['FLASKY_SYNC_INDEXES']:
+        from .indexes import sync_indexes
+        with app.app_context():
+            sync_indexes()
+
     return app
@@ -0,0 +1,152 @@
+"""Optional asyncio serving path for the read-heavy pages (Python 3 only).
+
+    uvicorn --factory app.aio:create_asgi_app --workers 4
+
+Anonymous GETs of the index, profile and post pages are answered here:
+their MongoDB reads go through motor and independent ones run
+concurrently, while the HTML comes from the same models, templates and
+response cache as the Flask app. Every other request, and any request from
+a signed-in user, is passed to the Flask app through asgiref's WSGI
+adapter, which runs it in a thread.
+
+Needs the packages in requirements/async.txt and a real MongoDB server:
+there is no motor driver for mongomock.
+"""
+import os
+from asgiref.wsgi import WsgiToAsgi
+from motor.motor_asyncio import AsyncIOMotorClient
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from werkzeug.test import EnvironBuilder
+from flask import current_app, request, session
+from . import views
+
+HANDLERS = {
+    'main.index': views.index,
+    'main.user': views.user,
+    'main.post': views.post,
+}
+
+
+class AsyncRequest(object):
+    """A request being served by an async handler.
+
+    Flask's request context is entered only around the synchronous steps
+    (cache lookups, rendering) and never held across an ``await``, so
+    concurrent requests on the event loop cannot see each other's context.
+    """
+
+    def __init__(self, app, db, environ):
+        self.app = app
+        self.db = db
+        self.environ = environ
+
+    def context(self):
+        return self.app.request_context(dict(self.environ))
+
+
+class AsyncReadApp(object):
+
+    def __init__(self, app):
+        config = app.config
+        if config['MONGODB_HOST'].startswith('mongomock://'):
+            raise RuntimeError('the asyncio path needs a real MongoDB server')
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        self.client = AsyncIOMotorClient(
+            config['MONGODB_HOST'],
+            maxPoolSize=config['MONGODB_POOL_SIZE'],
+            connectTimeoutMS=config['MONGODB_CONNECT_TIMEOUT_MS'],
+            socketTimeoutMS=config['MONGODB_SOCKET_TIMEOUT_MS'],
+            serverSelectionTimeoutMS=config['MONGODB_SERVER_SELECTION_TIMEOUT_MS'])
+        self.db = self.client[config['MONGODB_DB']]
+        self.urls = app.url_map.bind('localhost')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        handler = None
+        if scope['type'] == 'http' and scope['method'] == 'GET' and \
+                self._trusted_host(scope):
+            handler, view_args = self._match(self._path_info(scope))
+        if handler is not None:
+            req = AsyncRequest(self.app, self.db, self._environ(scope))
+            with req.context():
+                anonymous = self._anonymous()
+            if anonymous:
+                response = await handler(req, **view_args)
+                if response is not None:
+                    return await self._send(response, send)
+        await self.wsgi(scope, receive, send)
+
+    def _match(self, path):
+        try:
+            endpoint, view_args = self.urls.match(path, method='GET')
+        except (HTTPException, RequestRedirect):
+            return None, None
+        return HANDLERS.get(endpoint), view_args
+
+    @staticmethod
+    def _path_info(scope):
+        # the path includes the root path of a prefix mount, which asgiref
+        # strips the same way before it becomes SCRIPT_NAME
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        return path or '/'
+
+    @staticmethod
+    def _host(scope):
+        for name, value in scope['headers']:
+            if name == b'host':
+                return value.decode('latin-1')
+        return '%s:%d' % tuple(scope['server'])
+
+    def _trusted_host(self, scope):
+        # with SERVER_NAME set, requests for any other host are left to
+        # Flask, which refuses them; either way the response cache keys
+        # pages on the host they were built for
+        server_name = self.app.config.get('SERVER_NAME')
+        return server_name is None or self._host(scope) == server_name
+
+    def _environ(self, scope):
+        headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                   for name, value in scope['headers']]
+        return EnvironBuilder(
+            path=self._path_info(scope),
+            base_url='%s://%s%s' % (scope.get('scheme', 'http'),
+                                    self._host(scope),
+                                    scope.get('root_path', '')),
+            query_string=scope['query_string'].decode('latin-1'),
+            method='GET', headers=headers).get_environ()
+
+    def _anonymous(self):
+        # anything that makes the page depend on the visitor goes to Flask
+        remember = current_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token')
+        return '_user_id' not in session and '_flashes' not in session and \
+            request.authorization is None and remember not in request.cookies
+
+    async def _send(self, response, send):
+        body = response.get_data()
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in response.headers.items()]
+        await send({'type': 'http.response.start',
+                    'status': response.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(config_name=None):
+    from .. import create_app
+    app = create_app(config_name or os.environ.get('FLASK_CONFIG') or 'default')
+    return AsyncReadApp(app)
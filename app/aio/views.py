@@ -0,0 +1,192 @@
+"""Async versions of the anonymous index, user and post views.
+
+Each handler mirrors its Flask view in app/main/views.py. A handler
+returns None to hand the request to the Flask view instead, e.g. for an
+invalid cursor or a missing user, so error pages come from one place.
+"""
+import asyncio
+from flask import current_app, make_response, render_template, request
+from .. import response_cache
+from ..http_cache import latest, make_etag, not_modified, set_cache_headers
+from ..models import User, Post
+from ..pagination import CursorPagination, InvalidCursor, decode_cursor, \
+    lookup_count, remember_count
+
+
+class AsyncCursorPagination(CursorPagination):
+    """CursorPagination over a motor collection: construct it from the
+    request arguments, then ``await fetch()``; ``items`` are set once the
+    fetched documents have been turned into model instances."""
+
+    def __init__(self, per_page, before=None, after=None, key='timestamp',
+                 total=None):
+        self.per_page = per_page
+        self.key = key
+        self.total = total
+        self.items = []
+        # decoded up front so a bad cursor fails before any I/O
+        self.before = before is not None and decode_cursor(before) or None
+        self.after = after is not None and decode_cursor(after) or None
+
+    async def fetch(self, collection, query):
+        key = self.key
+        if self.after is not None:
+            value, id = self.after
+            query = {'$and': [query, {'$or': [{key: {'$gt': value}},
+                                              {key: value, '_id': {'$gt': id}}]}]}
+            sort = [(key, 1), ('_id', 1)]
+        else:
+            if self.before is not None:
+                value, id = self.before
+                query = {'$and': [query, {'$or': [{key: {'$lt': value}},
+                                                  {key: value, '_id': {'$lt': id}}]}]}
+            sort = [(key, -1), ('_id', -1)]
+        docs = await collection.find(query, sort=sort,
+                                     limit=self.per_page + 1).to_list(None)
+        more = len(docs) > self.per_page
+        docs = docs[:self.per_page]
+        if self.after is not None:
+            docs.reverse()
+            self.has_prev, self.has_next = more, True
+        else:
+            self.has_prev, self.has_next = self.before is not None, more
+        return docs
+
+
+def _collection(db, document):
+    return db[document._get_collection_name()]
+
+
+async def cached_count(collection, query, key, ttl):
+    """pagination.cached_count for a motor collection, sharing its cache."""
+    if not query:
+        return await collection.estimated_document_count()
+    count = lookup_count(key)
+    if count is None:
+        count = await collection.count_documents(query)
+        remember_count(key, count, ttl)
+    return count
+
+
+async def load_authors(db, docs):
+    """Raw author documents of the post documents, keyed by id, loaded
+    with one $in query."""
+    authors = {}
+    missing = set(d.get('author') for d in docs) - set([None])
+    if missing:
+        found = _collection(db, User).find({'_id': {'$in': list(missing)}})
+        for doc in await found.to_list(None):
+            authors[doc['_id']] = doc
+    return authors
+
+
+def hydrate(docs, authors, known=()):
+    """Post instances for raw post documents, with their authors set as
+    Post.prefetch_authors would."""
+    users = dict((id, User._from_son(doc)) for id, doc in authors.items())
+    users.update((u.id, u) for u in known)
+    posts = []
+    for doc in docs:
+        post = Post._from_son(doc)
+        author = users.get(doc.get('author'))
+        if author is not None:
+            post._data['author'] = author
+        posts.append(post)
+    return posts
+
+
+def _listing(per_page_key='FLASKY_POSTS_PER_PAGE'):
+    return AsyncCursorPagination(current_app.config[per_page_key],
+                                 before=request.args.get('before'),
+                                 after=request.args.get('after'))
+
+
+async def index(req):
+    with req.context():
+        key = response_cache.key(('posts',), {}) \
+            if response_cache.is_cacheable() else None
+        response = key and response_cache.lookup(key)
+        if response is not None:
+            return response
+        try:
+            pagination = _listing()
+        except InvalidCursor:
+            return None
+        ttl = current_app.config['FLASKY_COUNT_CACHE_TTL']
+    posts = _collection(req.db, Post)
+    docs, pagination.total = await asyncio.gather(
+        pagination.fetch(posts, {}),
+        cached_count(posts, {}, 'posts', ttl))
+    authors = await load_authors(req.db, docs)
+    with req.context():
+        pagination.items = hydrate(docs, authors)
+        response = make_response(render_template(
+            'index.html', form=None, posts=pagination.items,
+            show_followed=False, pagination=pagination))
+        return response_cache.store(key, response) if key else response
+
+
+async def user(req, username):
+    view_args = {'username': username}
+    with req.context():
+        key = response_cache.key(('user:{username}',), view_args) \
+            if response_cache.is_cacheable() else None
+        response = key and response_cache.lookup(key)
+        if response is not None:
+            return response
+        try:
+            pagination = _listing()
+        except InvalidCursor:
+            return None
+        ttl = current_app.config['FLASKY_COUNT_CACHE_TTL']
+    user_doc = await _collection(req.db, User).find_one({'username': username})
+    if user_doc is None:
+        return None
+    with req.context():
+        etag = make_etag('user', user_doc['_id'], user_doc.get('version', 0),
+                         user_doc.get('last_seen'))
+        last_modified = latest(user_doc.get('updated_at'),
+                               user_doc.get('last_seen'))
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
+    posts = _collection(req.db, Post)
+    query = {'author': user_doc['_id']}
+    docs, pagination.total = await asyncio.gather(
+        pagination.fetch(posts, query),
+        cached_count(posts, query, 'posts:%s' % username, ttl))
+    with req.context():
+        user = User._from_son(user_doc)
+        pagination.items = hydrate(docs, {}, known=[user])
+        response = make_response(render_template(
+            'user.html', user=user, posts=pagination.items,
+            pagination=pagination))
+        set_cache_headers(response, etag, last_modified)
+        return response_cache.store(key, response) if key else response
+
+
+async def post(req, idx):
+    view_args = {'idx': idx}
+    with req.context():
+        key = response_cache.key(('post:{idx}',), view_args) \
+            if response_cache.is_cacheable() else None
+        response = key and response_cache.lookup(key)
+        if response is not None:
+            return response
+    doc = await _collection(req.db, Post).find_one({'idx': idx})
+    if doc is None:
+        return None
+    with req.context():
+        author = 'author:%s' % doc.get('author')
+        etag = make_etag('post', doc['_id'], doc.get('version', 0),
+                         response_cache.generation(author))
+        last_modified = doc.get('edited_at') or doc.get('timestamp')
+        response = not_modified(etag, last_modified)
+        if response is not None:
+            return response
+    authors = await load_authors(req.db, [doc])
+    with req.context():
+        response = make_response(render_template(
+            'post.html', posts=hydrate([doc], authors)))
+        set_cache_headers(response, etag, last_modified)
+        return response_cache.store(key, response) if key else response
@@ -0,0 +1,28 @@
+from functools import wraps
+from flask import jsonify, request, abort
+from flask_login import current_user
+from . import api
+
+TOKEN_EXPIRATION = 3600
+
+
+def auth_required(f):
+    """Ask anonymous clients for HTTP Basic credentials with a 401, which
+    the HTML views' login redirect would not do."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if current_user.is_anonymous:
+            abort(401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@api.route('/tokens/', methods=['POST'])
+@auth_required
+def get_token():
+    auth = request.authorization
+    # a token cannot be used to obtain a fresh one
+    if auth is not None and not auth.password:
+        abort(401)
+    return jsonify({'token': current_user.generate_auth_token(TOKEN_EXPIRATION),
+                    'expiration': TOKEN_EXPIRATION})
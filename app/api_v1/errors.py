@@ -0,0 +1,30 @@
+from flask import jsonify
+from . import api
+
+
+def error_response(status, error, message=None):
+    response = jsonify({'error': error, 'message': message})
+    response.status_code = status
+    return response
+
+
+@api.errorhandler(400)
+def bad_request(e):
+    return error_response(400, 'bad request', e.description)
+
+
+@api.errorhandler(401)
+def unauthorized(e):
+    response = error_response(401, 'unauthorized', e.description)
+    response.headers['WWW-Authenticate'] = 'Basic realm="api"'
+    return response
+
+
+@api.errorhandler(403)
+def forbidden(e):
+    return error_response(403, 'forbidden', e.description)
+
+
+@api.errorhandler(404)
+def not_found(e):
+    return error_response(404, 'not found', e.description)
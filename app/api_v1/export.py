@@ -0,0 +1,72 @@
+import json
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Response, abort, current_app, request, stream_with_context
+from . import api
+from .serializers import POST_FIELDS, USER_FIELDS, post_json, user_json, \
+    usernames
+from .authentication import auth_required
+from ..decorators import admin_required
+from ..models import User, Post
+
+
+def _ndjson(records):
+    return ''.join(json.dumps(record) + '\n' for record in records)
+
+
+def _stream(document, fields, serialize):
+    """Stream a collection in _id order from a server-side cursor, one
+    FLASKY_API_EXPORT_BATCH of documents in memory at a time.
+
+    ``after`` resumes an interrupted export from the last id received.
+    """
+    query = {}
+    after = request.args.get('after')
+    if after:
+        try:
+            query['_id'] = {'$gt': ObjectId(after)}
+        except InvalidId:
+            abort(400, 'Invalid id in "after".')
+    batch_size = current_app.config['FLASKY_API_EXPORT_BATCH']
+    cursor = document._get_collection().find(
+        query, dict.fromkeys(fields, 1), sort=[('_id', 1)],
+        batch_size=batch_size, no_cursor_timeout=True)
+
+    def generate():
+        try:
+            batch = []
+            for doc in cursor:
+                batch.append(doc)
+                if len(batch) == batch_size:
+                    yield serialize(batch)
+                    batch = []
+            if batch:
+                yield serialize(batch)
+        finally:
+            cursor.close()
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+def _posts(docs):
+    authors = usernames(doc.get('author') for doc in docs)
+    return _ndjson(post_json(doc, authors) for doc in docs)
+
+
+def _users(docs):
+    return _ndjson(user_json(doc) for doc in docs)
+
+
+@api.route('/export/posts.ndjson')
+@auth_required
+@admin_required
+def export_posts():
+    return _stream(Post, POST_FIELDS, _posts)
+
+
+@api.route('/export/users.ndjson')
+@auth_required
+@admin_required
+def export_users():
+    return _stream(User, USER_FIELDS, _users)
@@ -0,0 +1,35 @@
+from flask import jsonify, abort
+from . import api
+from .serializers import POST_FIELDS, post_json, usernames, per_page, page_json
+from .. import response_cache
+from ..models import Post
+from ..pagination import cursor_paginate, cached_count
+
+
+def posts_page(query, endpoint, total=None, **kwargs):
+    pagination = cursor_paginate(query.only(*POST_FIELDS).no_dereference(),
+                                 per_page(), total=total)
+    docs = [post.to_mongo() for post in pagination.items]
+    authors = usernames(doc.get('author') for doc in docs)
+    response_cache.depends(*set('author:%s' % doc.get('author') for doc in docs))
+    return jsonify(page_json(pagination, endpoint, 'posts',
+                             [post_json(doc, authors) for doc in docs],
+                             **kwargs))
+
+
+@api.route('/posts/')
+@response_cache.cached('posts')
+def get_posts():
+    return posts_page(Post.objects, 'api.get_posts',
+                      total=cached_count(Post.objects, 'posts'))
+
+
+@api.route('/posts/<string:idx>')
+@response_cache.cached('post:{idx}')
+def get_post(idx):
+    post = Post.objects(idx=idx).only(*POST_FIELDS).no_dereference().first()
+    if post is None:
+        abort(404)
+    doc = post.to_mongo()
+    response_cache.depends('author:%s' % doc.get('author'))
+    return jsonify(post_json(doc, usernames([doc.get('author')])))
@@ -0,0 +1,94 @@
+"""JSON shapes of the API resources.
+
+The functions take raw MongoDB documents, as returned by pymongo or by
+``Document.to_mongo()``, so the paginated endpoints and the streaming
+export produce identical records.
+"""
+from flask import current_app, request, url_for
+from ..models import User
+
+POST_FIELDS = ('idx', 'body', 'body_html', 'timestamp', 'edited_at', 'author')
+USER_FIELDS = ('username', 'location', 'about_me', 'member_since', 'last_seen',
+               'followers_count', 'followed_count')
+
+
+def isoformat(value):
+    if value is not None:
+        return value.isoformat() + 'Z'
+
+
+def usernames(ids):
+    """Map user ids to usernames with one query."""
+    ids = list(set(i for i in ids if i is not None))
+    if not ids:
+        return {}
+    return dict((u['_id'], u['username']) for u in User._get_collection().find(
+        {'_id': {'$in': ids}}, {'username': 1}))
+
+
+def post_json(doc, authors):
+    author = authors.get(doc.get('author'))
+    idx = doc.get('idx') or str(doc['_id'])
+    return {
+        'id': idx,
+        'url': url_for('api.get_post', idx=idx, _external=True),
+        'body': doc.get('body'),
+        'body_html': doc.get('body_html'),
+        'timestamp': isoformat(doc.get('timestamp')),
+        'edited_at': isoformat(doc.get('edited_at')),
+        'author': author,
+        'author_url': author and url_for('api.get_user', username=author,
+                                         _external=True),
+    }
+
+
+def user_json(doc):
+    username = doc['username']
+    return {
+        'id': str(doc['_id']),
+        'username': username,
+        'url': url_for('api.get_user', username=username, _external=True),
+        'location': doc.get('location'),
+        'about_me': doc.get('about_me'),
+        'member_since': isoformat(doc.get('member_since')),
+        'last_seen': isoformat(doc.get('last_seen')),
+        'followers_count': doc.get('followers_count', 0),
+        'followed_count': doc.get('followed_count', 0),
+        'posts_url': url_for('api.get_user_posts', username=username,
+                             _external=True),
+        'followers_url': url_for('api.get_followers', username=username,
+                                 _external=True),
+        'followed_url': url_for('api.get_followed', username=username,
+                                _external=True),
+    }
+
+
+def follow_json(doc, field, username):
+    """The user on the ``field`` end of a Follow edge document."""
+    return {
+        'id': str(doc[field]),
+        'username': username,
+        'url': url_for('api.get_user', username=username, _external=True),
+        'timestamp': isoformat(doc.get('timestamp')),
+    }
+
+
+def per_page():
+    config = current_app.config
+    limit = request.args.get('limit', config['FLASKY_API_PER_PAGE'], type=int)
+    return max(1, min(limit, config['FLASKY_API_MAX_PER_PAGE']))
+
+
+def page_json(pagination, endpoint, name, records, **kwargs):
+    """A page of ``records`` with links to its neighbours."""
+    limit = pagination.per_page
+    return {
+        name: records,
+        'prev': pagination.prev_cursor and url_for(
+            endpoint, after=pagination.prev_cursor, limit=limit,
+            _external=True, **kwargs) or None,
+        'next': pagination.next_cursor and url_for(
+            endpoint, before=pagination.next_cursor, limit=limit,
+            _external=True, **kwargs) or None,
+        'count': pagination.total,
+    }
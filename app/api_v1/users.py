@@ -0,0 +1,69 @@
+from flask import jsonify, abort
+from . import api
+from .posts import posts_page
+from .serializers import USER_FIELDS, user_json, follow_json, usernames, \
+    per_page, page_json
+from .. import response_cache
+from ..models import User, Post, Follow
+from ..pagination import cursor_paginate, cached_count
+
+
+def _user_or_404(username):
+    user = User.objects(username=username).only('id', 'followers_count',
+                                                'followed_count').first()
+    if user is None:
+        abort(404)
+    return user
+
+
+@api.route('/users/')
+@response_cache.cached('users')
+def get_users():
+    query = User.objects.only(*USER_FIELDS)
+    pagination = cursor_paginate(query, per_page(), key='member_since',
+                                 total=cached_count(query, 'users'))
+    return jsonify(page_json(pagination, 'api.get_users', 'users',
+                             [user_json(u.to_mongo()) for u in pagination.items]))
+
+
+@api.route('/users/<username>')
+@response_cache.cached('user:{username}')
+def get_user(username):
+    user = User.objects(username=username).only(*USER_FIELDS).first()
+    if user is None:
+        abort(404)
+    return jsonify(user_json(user.to_mongo()))
+
+
+@api.route('/users/<username>/posts/')
+@response_cache.cached('user:{username}')
+def get_user_posts(username):
+    user = _user_or_404(username)
+    query = Post.objects(author=user.id)
+    return posts_page(query, 'api.get_user_posts',
+                      total=cached_count(query, 'posts:%s' % username),
+                      username=username)
+
+
+def _edges(query, field, total, endpoint, username):
+    pagination = cursor_paginate(query.only(field, 'timestamp'), per_page(),
+                                 total=total)
+    names = usernames(getattr(edge, field) for edge in pagination.items)
+    records = [follow_json(edge.to_mongo(), field, names[getattr(edge, field)])
+               for edge in pagination.items if getattr(edge, field) in names]
+    return jsonify(page_json(pagination, endpoint, 'users', records,
+                             username=username))
+
+
+@api.route('/users/<username>/followers/')
+def get_followers(username):
+    user = _user_or_404(username)
+    return _edges(Follow.objects(followed=user.id), 'follower',
+                  user.followers_count, 'api.get_followers', username)
+
+
+@api.route('/users/<username>/followed/')
+def get_followed(username):
+    user = _user_or_404(username)
+    return _edges(Follow.objects(follower=user.id), 'followed',
+                  user.followed_count, 'api.get_followed', username)
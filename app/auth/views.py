@@ -11,6 +11,8 @@ from .forms import LoginForm, RegistrationForm, ChangePasswordForm,\
 
 @auth.before_app_request
 def before_request():
+    if current_user.is_authenticated:
+        current_user.ping()
     if current_user.is_authenticated \
             and not current_user.confirmed \
             and request.endpoint \
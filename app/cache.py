@@ -0,0 +1,396 @@
+import copy
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from flask import current_app, g, has_app_context, make_response, \
+    render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from werkzeug.utils import import_string
+
+
+class CacheBackend(object):
+    """Interface every cache store implements.
+
+    Values handed to a backend are plain data (dicts, strings, tuples), so
+    a shared backend can serialize them however it likes.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """Bounded in-process cache with optional per-entry expiry."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            # move to the most recently used end
+            del self._data[key]
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DictStore(CacheBackend):
+    """Stand-in for a shared store such as memcached or Redis.
+
+    Values are pickled on the way in, like a networked backend would, so
+    callers never share mutable objects through it.
+    """
+
+    def __init__(self, app=None):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (pickle.dumps(value, -1), expires)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache(CacheBackend):
+    """A per-process LRU in front of an optional shared backend."""
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+def make_backend(app, maxsize, ttl):
+    """Build the cache stack configured for ``app``.
+
+    FLASKY_CACHE_BACKEND names a factory ('package.module:callable') that
+    takes the app and returns the shared CacheBackend; leave it unset to
+    cache in-process only.
+    """
+    shared = app.config.get('FLASKY_CACHE_BACKEND')
+    if isinstance(shared, str):
+        shared = import_string(shared)(app)
+    elif callable(shared):
+        shared = shared(app)
+    return TieredCache(LRUCache(maxsize, ttl), shared)
+
+
+class DocumentCache(object):
+    """Caches MongoEngine documents by id, stored as their raw BSON dicts
+    so every lookup hands out a fresh, unshared document.
+
+    With a shared backend configured the documents live there only:
+    ``invalidate`` can't reach the per-process LRU of other workers, which
+    would otherwise keep serving a stale role, ``confirmed`` flag or
+    password hash until the entry expired.
+    """
+
+    def __init__(self, prefix, app=None):
+        self.prefix = prefix
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = 'FLASKY_%s_CACHE_' % self.prefix.upper()
+        self.ttl = app.config[name + 'TTL']
+        backend = make_backend(app, app.config[name + 'SIZE'], self.ttl)
+        self.backend = backend.shared or backend
+
+    def _key(self, id):
+        return '%s:%s' % (self.prefix, id)
+
+    def get(self, document_cls, id, load):
+        son = self.backend.get(self._key(id))
+        with self._lock:
+            if son is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if son is not None:
+            return document_cls._from_son(copy.deepcopy(son))
+        document = load()
+        if document is not None:
+            self.backend.set(self._key(id), document.to_mongo().to_dict(),
+                             self.ttl)
+        return document
+
+    def invalidate(self, id):
+        self.backend.delete(self._key(id))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+class ResponseCache(object):
+    """Caches whole pages for anonymous readers and rendered post fragments
+    for everyone.
+
+    Entries are keyed on the generation of the tags they depend on
+    ('posts', 'user:<username>', ...). Saving a Post or User bumps its
+    tags, which makes every entry built from the old generation
+    unreachable; the entries themselves age out of the LRU.
+
+    What a page shows of each post's author is tracked per author: a
+    rendered fragment is keyed on its author's 'author:<id>' generation,
+    and a page records the generations of the authors it showed, so an
+    author's change only invalidates the pages that show them.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['FLASKY_RESPONSE_CACHE']
+        self.ttl = config['FLASKY_RESPONSE_CACHE_TTL']
+        self.backend = make_backend(app, config['FLASKY_RESPONSE_CACHE_SIZE'],
+                                    self.ttl)
+        # generations must be read from the shared store when there is one,
+        # never from a per-process copy
+        self.tags = self.backend.shared or \
+            LRUCache(config['FLASKY_RESPONSE_CACHE_SIZE'])
+        app.add_template_global(self.post_fragment, 'post_fragment')
+
+    def generation(self, tag):
+        generations = g.setdefault('cache_generations', {})
+        if tag not in generations:
+            value = self.tags.get('gen:' + tag)
+            if value is None:
+                value = uuid.uuid4().hex[:12]
+                self.tags.set('gen:' + tag, value)
+            generations[tag] = value
+        return generations[tag]
+
+    def bump(self, *tags):
+        for tag in tags:
+            self.tags.set('gen:' + tag, uuid.uuid4().hex[:12])
+        if has_app_context():
+            generations = g.get('cache_generations')
+            if generations:
+                for tag in tags:
+                    generations.pop(tag, None)
+
+    def depends(self, *tags):
+        """Record that the response being built shows data under ``tags``
+        that its key doesn't cover; ``store`` keeps their generations with
+        the entry and ``lookup`` rejects it once any of them has moved on."""
+        depends = g.setdefault('cache_depends', {})
+        for tag in tags:
+            depends[tag] = self.generation(tag)
+
+    def limit_ttl(self, seconds):
+        """Keep the response being built, and the post fragments rendered
+        for it, in the cache for at most ``seconds``, e.g. because it was
+        read from a lagging replica."""
+        g.cache_ttl = min(seconds, g.get('cache_ttl', self.ttl))
+
+    def _current(self, entry):
+        return all(self.generation(tag) == value
+                   for tag, value in entry.get('depends', ()))
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def is_cacheable(self):
+        return self.enabled and request.method == 'GET' and \
+            current_user.is_anonymous and '_flashes' not in session
+
+    def _cacheable_for_all(self):
+        return self.enabled and request.method == 'GET'
+
+    def key(self, tags, view_args):
+        # the scheme and host show in the page, e.g. in the gravatar URLs
+        # and in external links, so a request with a forged Host header
+        # must not fill the entry other requests are served from
+        parts = [request.host_url, request.endpoint]
+        parts.extend('%s=%s' % item for item in sorted(view_args.items()))
+        parts.extend('%s=%s' % item for item in sorted(request.args.items()))
+        parts.extend(self.generation(tag.format(**view_args)) for tag in tags)
+        return 'page:' + hashlib.md5(
+            u'|'.join(parts).encode('utf-8')).hexdigest()
+
+    def cached(self, *tags):
+        """Serve the view from the cache for anonymous GET requests.
+
+        ``tags`` are format strings filled in with the view arguments,
+        e.g. 'user:{username}'.
+        """
+        return self._decorator(tags, self.is_cacheable)
+
+    def cached_for_all(self, *tags):
+        """Like ``cached``, for views whose output does not depend on who
+        is signed in, such as feeds."""
+        return self._decorator(tags, self._cacheable_for_all)
+
+    def _decorator(self, tags, cacheable):
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not cacheable():
+                    return f(*args, **kwargs)
+                key = self.key(tags, kwargs)
+                response = self.lookup(key)
+                if response is None:
+                    response = self.store(key, make_response(f(*args, **kwargs)))
+                return response
+            return decorated_function
+        return decorator
+
+    def lookup(self, key):
+        """The cached response stored under ``key``, or None."""
+        entry = self.backend.get(key)
+        if entry is not None and not self._current(entry):
+            entry = None
+        self._count(entry is not None)
+        if entry is not None:
+            return self._respond(entry)
+
+    def store(self, key, response):
+        """Cache a successful response under ``key`` and return it as it
+        would be served from the cache."""
+        depends = g.pop('cache_depends', {})
+        ttl = g.pop('cache_ttl', self.ttl)
+        if response.status_code != 200 or response.direct_passthrough:
+            return response
+        body = response.get_data()
+        entry = {'body': body,
+                 'depends': sorted(depends.items()),
+                 'content_type': response.content_type,
+                 'headers': [(name, response.headers[name])
+                             for name in ('Cache-Control', 'Vary')
+                             if name in response.headers],
+                 'etag': response.get_etag()[0] or hashlib.md5(body).hexdigest(),
+                 'last_modified': response.last_modified or
+                                  datetime.utcnow().replace(microsecond=0)}
+        self.backend.set(key, entry, ttl)
+        return self._respond(entry)
+
+    def _respond(self, entry):
+        response = current_app.response_class(
+            entry['body'], content_type=entry['content_type'],
+            headers=entry['headers'])
+        response.set_etag(entry['etag'])
+        response.last_modified = entry['last_modified']
+        return response.make_conditional(request)
+
+    def post_fragment(self, post):
+        """The viewer-independent part of a post in _posts.html."""
+        author = 'author:%s' % getattr(post._data.get('author'), 'id', None)
+        self.depends(author)
+        key = 'post:%s:%s:%s:%s' % (post.id, request.scheme,
+                                    self.generation('post:%s' % post.idx),
+                                    self.generation(author))
+        html = self.backend.get(key) if self.enabled else None
+        self._count(html is not None)
+        if html is None:
+            html = render_template('_post.html', post=post)
+            if self.enabled:
+                # capped like the page by limit_ttl, since the post may
+                # have been read from a lagging replica
+                self.backend.set(key, html, g.get('cache_ttl', self.ttl))
+        return Markup(html)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / total if total else 0.0}
@@ -0,0 +1,98 @@
+import time
+from flask import current_app, has_request_context, request, session
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, \
+    SecondaryPreferred, Nearest
+
+SECONDARY = 'secondary'
+
+_READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+
+def read_preference(name, max_staleness=-1):
+    if name == 'primary':
+        return Primary()
+    return _READ_PREFERENCES[name](max_staleness=max_staleness)
+
+
+def mongodb_settings(config):
+    """MONGODB_SETTINGS for flask_mongoengine, built from the MONGODB_*
+    options: the 'default' alias on the primary and, when a secondary read
+    preference is configured, a 'secondary' alias for read-only listings.
+
+    mongomock has no replication and ignores pool options, so against a
+    mongomock:// host only the default alias is created.
+    """
+    base = {'db': config['MONGODB_DB'], 'host': config['MONGODB_HOST']}
+    mock = config['MONGODB_HOST'].startswith('mongomock://')
+    if not mock:
+        base.update(maxPoolSize=config['MONGODB_POOL_SIZE'],
+                    connectTimeoutMS=config['MONGODB_CONNECT_TIMEOUT_MS'],
+                    socketTimeoutMS=config['MONGODB_SOCKET_TIMEOUT_MS'],
+                    serverSelectionTimeoutMS=
+                        config['MONGODB_SERVER_SELECTION_TIMEOUT_MS'],
+                    w=config['MONGODB_WRITE_CONCERN'])
+    settings = [dict(base, alias='default')]
+    if config['MONGODB_SECONDARY_READ_PREFERENCE'] and not mock:
+        settings.append(dict(base, alias=SECONDARY, read_preference=read_preference(
+            config['MONGODB_SECONDARY_READ_PREFERENCE'],
+            config['MONGODB_SECONDARY_MAX_STALENESS'])))
+    return settings
+
+
+class ReadRouter(object):
+    """Sends read-only listings to the secondary alias.
+
+    Views wrap the querysets they may read from a secondary with ``reads``;
+    whether they actually do is decided per endpoint by
+    FLASKY_SECONDARY_READ_VIEWS. Reads stay on the primary for
+    FLASKY_READ_YOUR_WRITES seconds after a user's own write. A page built
+    from secondary reads is kept in the response cache for at most
+    FLASKY_SECONDARY_CACHE_TTL seconds, so replication lag cached under a
+    fresh generation soon expires.
+    """
+
+    def __init__(self, app=None):
+        self.secondary = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # must run before db.init_app, which connects the aliases
+        settings = app.config.setdefault('MONGODB_SETTINGS',
+                                         mongodb_settings(app.config))
+        if isinstance(settings, dict):
+            settings = [settings]
+        self.secondary = any(s.get('alias') == SECONDARY for s in settings)
+        self.views = frozenset(app.config['FLASKY_SECONDARY_READ_VIEWS'])
+        app.extensions['read_router'] = self
+        app.before_request(self._track_writes)
+
+    def _track_writes(self):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            self.stick_to_primary()
+
+    def stick_to_primary(self):
+        """Keep the current session on the primary for a while, so a user
+        sees their own changes; called for every non-GET request and by
+        the GET views that write."""
+        session['_primary_until'] = \
+            time.time() + current_app.config['FLASKY_READ_YOUR_WRITES']
+
+    def use_secondary(self):
+        return self.secondary and has_request_context() and \
+            request.endpoint in self.views and \
+            session.get('_primary_until', 0) < time.time()
+
+    def reads(self, queryset):
+        if self.use_secondary():
+            from . import response_cache
+            response_cache.limit_ttl(
+                current_app.config['FLASKY_SECONDARY_CACHE_TTL'])
+            return queryset.using(SECONDARY)
+        return queryset
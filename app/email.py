@@ -1,20 +1,304 @@
-from threading import Thread
-from flask import current_app, render_template
+import atexit
+import os
+import re
+import smtplib
+import socket
+import threading
+import time
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+from flask import current_app, render_template, request, has_request_context
 from flask_mail import Message
-from . import mail
+from markupsafe import escape
 
+_STOP = object()
+_SLOT = re.compile(r'(__slot_\d+__)')
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+def _refused(error):
+    """Whether the server permanently refused one message, as opposed to
+    the connection failing."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and \
+        500 <= error.smtp_code < 600
+
+
+class _Slot(object):
+    """Placeholder for a per-recipient value while a skeleton renders."""
+
+    def __init__(self, path, slots):
+        self._path = path
+        self._slots = slots
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Slot(self._path + '.' + name, self._slots)
+
+    def __str__(self):
+        if self._path not in self._slots:
+            self._slots[self._path] = '__slot_%d__' % len(self._slots)
+        return self._slots[self._path]
+
+    __unicode__ = __str__
+
+
+class Skeleton(object):
+    """A rendered template split into static text and recipient slots."""
+
+    def __init__(self, text, slots, autoescape):
+        markers = dict((marker, path) for path, marker in slots.items())
+        self.parts = [markers.get(part, part) for part in _SLOT.split(text)]
+        self.paths = sorted(slots)
+        self.autoescape = autoescape
+
+    def fill(self, values):
+        out = []
+        for i, part in enumerate(self.parts):
+            if i % 2:
+                part = values[part]
+                if self.autoescape:
+                    part = escape(part)
+            out.append(part)
+        return u''.join(out)
+
+
+class MailRenderer(object):
+    """Renders mail templates from skeletons compiled once per process.
+
+    The first use of a template renders it with placeholders standing in
+    for the keyword arguments that vary per recipient; every later message
+    is a join of the static chunks and that recipient's values. Scalar
+    arguments (None, booleans, numbers) are baked into the skeleton. Values
+    are only HTML-escaped when filled in, so anything passed to url_for()
+    must already be URL-safe, as the itsdangerous tokens are; bytes are
+    decoded as UTF-8.
+    """
+
+    def __init__(self):
+        self._skeletons = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def split(kwargs):
+        shared, slots = {}, {}
+        for name, value in kwargs.items():
+            if value is None or isinstance(value, (bool, int, float)):
+                shared[name] = value
+            else:
+                slots[name] = value
+        return shared, slots
+
+    def skeleton(self, template, shared, names):
+        host = request.host_url if has_request_context() else None
+        key = (template, host, tuple(sorted(shared.items())), tuple(sorted(names)))
+        skeleton = self._skeletons.get(key)
+        if skeleton is None:
+            slots = {}
+            context = dict(shared)
+            context.update((name, _Slot(name, slots)) for name in names)
+            text = render_template(template, **context)
+            skeleton = Skeleton(
+                text, slots, current_app.select_jinja_autoescape(template))
+            with self._lock:
+                self._skeletons[key] = skeleton
+        return skeleton
+
+    @staticmethod
+    def resolve(skeletons, slots):
+        values = {}
+        for skeleton in skeletons:
+            for path in skeleton.paths:
+                if path not in values:
+                    name = path.split('.')
+                    value = slots[name[0]]
+                    for attr in name[1:]:
+                        value = getattr(value, attr)
+                    # the itsdangerous tokens are bytes on Python 3
+                    if isinstance(value, bytes):
+                        value = value.decode('utf-8')
+                    values[path] = u'%s' % value
+        return values
+
+
+class MailJob(object):
+    """Everything a worker needs to build one message, as plain data."""
+
+    def __init__(self, subject, sender, to, skeletons, values):
+        self.subject = subject
+        self.sender = sender
+        self.to = to
+        self.skeletons = skeletons
+        self.values = values
+
+    def build(self):
+        text, html = self.skeletons
+        msg = Message(self.subject, sender=self.sender, recipients=[self.to])
+        msg.body = text.fill(self.values)
+        msg.html = html.fill(self.values)
+        return msg
+
+
+class MailDispatcher(object):
+    """Delivers mail from a bounded queue with a fixed pool of workers.
+
+    Each worker takes up to FLASKY_MAIL_BATCH queued messages and sends them
+    over a single SMTP connection. A full queue makes ``send`` wait up to
+    FLASKY_MAIL_ENQUEUE_TIMEOUT seconds and then raise ``queue.Full``.
+    """
+
+    def __init__(self, app=None):
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        config = app.config
+        self.queue = Queue(config['FLASKY_MAIL_QUEUE_SIZE'])
+        self.workers = config['FLASKY_MAIL_WORKERS']
+        self.batch_size = config['FLASKY_MAIL_BATCH']
+        self.retries = config['FLASKY_MAIL_RETRIES']
+        self.retry_delay = config['FLASKY_MAIL_RETRY_DELAY']
+        self.enqueue_timeout = config['FLASKY_MAIL_ENQUEUE_TIMEOUT']
+        self.renderer = MailRenderer()
+        app.extensions['mail_dispatcher'] = self
+        atexit.register(self.shutdown)
+
+    def send(self, msg):
+        self._ensure_workers()
+        self.queue.put(msg, timeout=self.enqueue_timeout)
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name='mail-worker-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            stop = item is _STOP
+            batch = [] if stop else [item]
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                try:
+                    self._deliver(batch)
+                except Exception:
+                    self.app.logger.exception('Mail delivery failed')
+            for _ in range(len(batch) + stop):
+                self.queue.task_done()
+            if stop:
+                return
+
+    def _deliver(self, batch):
+        """Send ``batch`` over as few connections as possible.
+
+        A message the server refuses, or that can't be built, is logged and
+        skipped. Connection failures are retried with exponential backoff:
+        a message that keeps failing after FLASKY_MAIL_RETRIES reconnects is
+        dropped on its own, and the rest of the batch is only dropped when
+        no connection can be made at all.
+        """
+        mail = self.app.extensions['mail']
+        pending = list(batch)
+        attempt = 0
+        with self.app.app_context():
+            while pending:
+                sending = False
+                try:
+                    with mail.connect() as conn:
+                        while pending:
+                            msg = pending[0]
+                            sending = True
+                            try:
+                                if isinstance(msg, MailJob):
+                                    msg = pending[0] = msg.build()
+                                conn.send(msg)
+                            except (smtplib.SMTPException, socket.error) as e:
+                                if not _refused(e):
+                                    raise
+                                self._skip(msg, e)
+                            except Exception as e:
+                                self._skip(msg, e)
+                            pending.pop(0)
+                            sending = False
+                            attempt = 0
+                except (smtplib.SMTPException, socket.error):
+                    attempt += 1
+                    if attempt <= self.retries:
+                        time.sleep(self.retry_delay * 2 ** (attempt - 1))
+                    elif sending:
+                        self.app.logger.exception(
+                            'Dropping mail to %s after %d attempts',
+                            self._recipients(pending.pop(0)), attempt)
+                        attempt = 0
+                    else:
+                        self.app.logger.exception(
+                            'Dropping %d messages after %d attempts',
+                            len(pending), attempt)
+                        return
+
+    @staticmethod
+    def _recipients(msg):
+        return msg.recipients if isinstance(msg, Message) else [msg.to]
+
+    def _skip(self, msg, error):
+        self.app.logger.warning('Not delivering mail to %s: %s',
+                                self._recipients(msg), error)
+
+    def shutdown(self, timeout=None):
+        """Deliver everything already queued, then stop the workers."""
+        if self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._pid = None
 
 
 def send_email(to, subject, template, **kwargs):
+    send_bulk(subject, template, [(to, kwargs)])
+
+
+def send_bulk(subject, template, recipients):
+    """Queue one message per (to, kwargs) pair in ``recipients``.
+
+    The request thread only compiles the template skeletons (once per
+    process) and collects each recipient's values; the text and HTML
+    bodies are assembled by the mail workers.
+    """
     app = current_app._get_current_object()
-    msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    dispatcher = app.extensions['mail_dispatcher']
+    renderer = dispatcher.renderer
+    subject = app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject
+    sender = app.config['FLASKY_MAIL_SENDER']
+    for to, kwargs in recipients:
+        shared, slots = renderer.split(kwargs)
+        skeletons = (renderer.skeleton(template + '.txt', shared, slots),
+                     renderer.skeleton(template + '.html', shared, slots))
+        values = renderer.resolve(skeletons, slots)
+        dispatcher.send(MailJob(subject, sender, to, skeletons, values))
@@ -0,0 +1,245 @@
+"""Bulk fake data for development databases and load tests.
+
+Documents are built as plain dicts and written with insert_many in chunks,
+so none of the per-document signals run; the follower counters, celebrity
+flags and timelines they would maintain are computed here instead. The
+same seed produces the same users, follow graph and posts, dated relative
+to the time of the run.
+"""
+import bisect
+import hashlib
+import heapq
+import random
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import current_app
+from pymongo.errors import BulkWriteError
+from . import response_cache, password_hasher
+from .models import Role, User, Post, Follow, BODY_HTML_VERSION
+from .timeline import Timeline
+
+CHUNK = 1000
+# distinct post bodies; each is rendered once and shared by many posts
+BODIES = 500
+PASSWORD = 'password'
+DUPLICATE_KEY = 11000
+
+
+def _now():
+    now = datetime.utcnow()
+    # MongoDB keeps milliseconds, so match what a read would return
+    return now.replace(microsecond = now.microsecond // 1000 * 1000)
+
+
+def _between(rng, start, end):
+    seconds = int((end - start).total_seconds())
+    return start + timedelta(seconds = rng.randint(0, max(seconds, 0)))
+
+
+def _object_id(rng, when):
+    # time-ordered like a driver-generated id, but drawn from the seed
+    epoch = int((when - datetime(1970, 1, 1)).total_seconds())
+    return ObjectId('%08x%016x' % (epoch, rng.getrandbits(64)))
+
+
+def _insert(document, docs, chunk):
+    """Insert ``docs`` in unordered batches and return the ones written,
+    leaving out those rejected by a unique index."""
+    collection = document._get_collection()
+    written = []
+    for i in range(0, len(docs), chunk):
+        batch = docs[i:i + chunk]
+        rejected = set()
+        try:
+            collection.insert_many(batch, ordered = False)
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                if error['code'] != DUPLICATE_KEY:
+                    raise
+                rejected.add(error['index'])
+        written.extend(d for n, d in enumerate(batch) if n not in rejected)
+    return written
+
+
+def _user_docs(count, rng, now):
+    import forgery_py
+    role = Role.table().default()
+    password_hash = password_hasher.hash(PASSWORD)
+    docs = []
+    for i in range(count):
+        username = '%s%d' % (forgery_py.internet.user_name(True), i)
+        email = '%s@example.com' % username
+        member_since = _between(rng, now - timedelta(days = 730), now)
+        docs.append({
+            '_id': _object_id(rng, member_since),
+            'email': email,
+            'username': username,
+            'password_hash': password_hash,
+            'confirmed': True,
+            'role': role.id,
+            'location': forgery_py.address.city(),
+            'about_me': forgery_py.lorem_ipsum.sentence(),
+            'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest(),
+            'member_since': member_since,
+            'followers_count': 0,
+            'followed_count': 0,
+            'version': 0,
+        })
+    return docs
+
+
+def _bodies(count):
+    import forgery_py
+    bodies = []
+    for _ in range(count):
+        body = forgery_py.lorem_ipsum.sentences(random.randint(1, 5))
+        bodies.append((body, Post.render_body(body)))
+    return bodies
+
+
+class PowerLaw(object):
+    """Picks users with probability proportional to 1 / rank ** alpha.
+
+    Ranks are a shuffle of the users, so popularity is unrelated to the
+    order they were created in. An alpha of 0 picks uniformly.
+    """
+
+    def __init__(self, users, alpha, rng):
+        self.users = list(users)
+        rng.shuffle(self.users)
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(self.users) + 1):
+            total += 1.0 / rank ** alpha
+            self.cumulative.append(total)
+
+    def pick(self):
+        point = self.rng.random() * self.cumulative[-1]
+        i = bisect.bisect_right(self.cumulative, point)
+        return self.users[min(i, len(self.users) - 1)]
+
+
+def _follow_docs(users, count, alpha, rng, now):
+    if len(users) < 2:
+        return []
+    popular = PowerLaw(users, alpha, rng)
+    count = min(count, len(users) * (len(users) - 1))
+    seen = set()
+    docs = []
+    attempts = 0
+    while len(docs) < count and attempts < count * 10:
+        attempts += 1
+        follower, followed = rng.choice(users), popular.pick()
+        key = (follower['_id'], followed['_id'])
+        if follower is followed or key in seen:
+            continue
+        seen.add(key)
+        since = max(follower['member_since'], followed['member_since'])
+        docs.append({'follower': follower['_id'],
+                     'followed': followed['_id'],
+                     'timestamp': _between(rng, since, now)})
+        follower['followed_count'] += 1
+        followed['followers_count'] += 1
+    return docs
+
+
+def _post_docs(authors, count, rng, now):
+    bodies = _bodies(min(count, BODIES))
+    for _ in range(count):
+        author = rng.choice(authors)
+        body, body_html = rng.choice(bodies)
+        timestamp = _between(rng, author['member_since'], now)
+        oid = _object_id(rng, timestamp)
+        yield {'_id': oid,
+               'idx': str(oid),
+               'author': author['_id'],
+               'body': body,
+               'body_html': body_html,
+               'body_html_version': BODY_HTML_VERSION,
+               'timestamp': timestamp,
+               'version': 0}
+
+
+def _timelines(users, follows, newest, length):
+    limit = current_app.config['FLASKY_TIMELINE_FANOUT_LIMIT']
+    followers = dict((u['_id'], u['followers_count']) for u in users)
+    followed = {}
+    for f in follows:
+        if followers[f['followed']] <= limit:
+            followed.setdefault(f['follower'], []).append(f['followed'])
+    for user in users:
+        authors = [user['_id']] + followed.get(user['_id'], [])
+        entries = heapq.nlargest(length, (e for a in authors
+                                          for e in newest.get(a, ())))
+        yield {'_id': user['_id'],
+               'entries': [{'post': post, 'author': author, 'timestamp': ts}
+                           for ts, post, author in entries]}
+
+
+def populate(users, posts, follows, alpha = 1.0, seed = 0, chunk = CHUNK):
+    """Load a consistent dataset of ``users``, ``follows`` follow edges and
+    ``posts`` into an empty database and return what was written."""
+    if User.objects.first() is not None:
+        raise ValueError('populate() needs an empty users collection')
+    rng = random.Random(seed)
+    # forgery_py draws from the module-level generator
+    random.seed(seed)
+    now = _now()
+    length = current_app.config['FLASKY_TIMELINE_LENGTH']
+    limit = current_app.config['FLASKY_TIMELINE_FANOUT_LIMIT']
+
+    user_docs = _user_docs(users, rng, now)
+    follow_docs = _follow_docs(user_docs, follows, alpha, rng, now)
+    by_id = dict((u['_id'], u) for u in user_docs)
+    for f in follow_docs:
+        if by_id[f['followed']]['followers_count'] > limit:
+            f['celebrity'] = True
+    _insert(User, user_docs, chunk)
+    _insert(Follow, follow_docs, chunk)
+
+    # keep only the newest posts of each author for the timelines
+    newest = {}
+    batch = []
+    written = 0
+    for doc in _post_docs(user_docs, posts, rng, now):
+        entry = (doc['timestamp'], doc['_id'], doc['author'])
+        heap = newest.setdefault(doc['author'], [])
+        if len(heap) < length:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+        batch.append(doc)
+        if len(batch) == chunk:
+            written += len(_insert(Post, batch, chunk))
+            batch = []
+    written += len(_insert(Post, batch, chunk))
+
+    timelines = list(_timelines(user_docs, follow_docs, newest, length))
+    _insert(Timeline, timelines, chunk)
+    response_cache.bump('posts', 'users')
+    return {'users': len(user_docs), 'follows': len(follow_docs),
+            'posts': written, 'timelines': len(timelines)}
+
+
+def add_users(count, seed = None, chunk = CHUNK):
+    """Insert ``count`` unfollowed users next to the existing ones."""
+    rng = random.Random(seed)
+    random.seed(seed)
+    written = _insert(User, _user_docs(count, rng, _now()), chunk)
+    response_cache.bump('users')
+    return len(written)
+
+
+def add_posts(count, seed = None, chunk = CHUNK):
+    """Insert ``count`` posts by randomly chosen existing users. Timelines
+    are not updated; rebuild them or use populate() for a followed feed."""
+    rng = random.Random(seed)
+    random.seed(seed)
+    authors = [{'_id': u.id, 'member_since': u.member_since or _now()}
+               for u in User.objects.only('id', 'member_since')]
+    if not authors:
+        return 0
+    written = _insert(Post, list(_post_docs(authors, count, rng, _now())), chunk)
+    response_cache.bump('posts')
+    return len(written)
@@ -0,0 +1,115 @@
+import atexit
+import multiprocessing
+import os
+import threading
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    # forking a threaded server can copy a lock some other thread holds;
+    # spawned workers start from a fresh interpreter
+    _context = multiprocessing.get_context('spawn')
+except AttributeError:  # Python 2 only forks
+    _context = multiprocessing
+
+
+def _parse_method(method):
+    """Split a werkzeug method such as 'pbkdf2:sha256:600000' into its
+    name and parameters, with the iteration count as an int."""
+    name, _, params = method.partition(':')
+    params = params.split(':') if params else []
+    if name == 'pbkdf2' and len(params) == 2:
+        params[1] = int(params[1])
+    return name, params
+
+
+class PasswordHasher(object):
+    """Runs password hashing in a pool of FLASKY_PASSWORD_HASH_WORKERS
+    processes, so a burst of logins competes for a fixed number of CPUs
+    instead of every web worker's.
+
+    At most FLASKY_PASSWORD_HASH_QUEUE hashes are queued or running; past
+    that, callers wait up to FLASKY_PASSWORD_HASH_TIMEOUT seconds for room
+    and then get ``queue.Full``, as they do for a hash the pool has not
+    finished within FLASKY_PASSWORD_HASH_RESULT_TIMEOUT seconds, e.g.
+    because its worker died. With no workers the hashing runs inline. Hashes are created with FLASKY_PASSWORD_HASH_METHOD, and stored
+    hashes made with another method or fewer iterations are reported by
+    ``needs_rehash``.
+    """
+
+    def __init__(self, app=None):
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wanted = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.method = config['FLASKY_PASSWORD_HASH_METHOD']
+        self.workers = config['FLASKY_PASSWORD_HASH_WORKERS']
+        self.timeout = config['FLASKY_PASSWORD_HASH_TIMEOUT']
+        self.result_timeout = config['FLASKY_PASSWORD_HASH_RESULT_TIMEOUT']
+        self._wanted = None
+        self._slots = Queue(config['FLASKY_PASSWORD_HASH_QUEUE'])
+        app.extensions['password_hasher'] = self
+        atexit.register(self.shutdown)
+
+    def _ensure_pool(self):
+        # a pool inherited through fork belongs to the parent, so every
+        # worker process starts its own
+        if self._pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = _context.Pool(self.workers)
+                self._pid = os.getpid()
+        return self._pool
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        self._slots.put(None, timeout=self.timeout)
+        try:
+            result = self._ensure_pool().apply_async(func, args)
+            try:
+                return result.get(self.result_timeout)
+            except multiprocessing.TimeoutError:
+                # hashing inline too would double the CPU spent on it
+                raise Full()
+        finally:
+            self._slots.get_nowait()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        if self._wanted is None:
+            # werkzeug fills in defaults, e.g. the iteration count, when it
+            # writes the method into a hash, so compare against what it
+            # writes for the configured method
+            written = generate_password_hash('', self.method)
+            self._wanted = _parse_method(written.split('$', 1)[0])
+        name, params = _parse_method(password_hash.split('$', 1)[0])
+        wanted_name, wanted = self._wanted
+        if name != wanted_name or len(params) != len(wanted):
+            return True
+        if name == 'pbkdf2' and len(params) == 2:
+            return params[0] != wanted[0] or params[1] < wanted[1]
+        return params != wanted
+
+    def shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+        self._pid = None
@@ -0,0 +1,48 @@
+import hashlib
+from flask import current_app, request, session
+from flask_login import current_user
+
+
+def make_etag(*parts):
+    """A validator for the page built from ``parts``, the request's query
+    string and, for signed-in users, who is looking at it."""
+    parts = list(parts) + [request.query_string]
+    if current_user.is_authenticated:
+        parts.extend([current_user.id, current_user.version])
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def latest(*times):
+    """The newest of ``times`` that are set, for a page showing several
+    timestamped things; None if none are."""
+    return max([t for t in times if t is not None] or [None])
+
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response when the client's copy is still current."""
+    if '_flashes' in session:
+        return None
+    response = current_app.response_class(status=304)
+    set_cache_headers(response, etag, last_modified)
+    since = request.if_modified_since
+    if request.if_none_match:
+        if not request.if_none_match.contains(etag):
+            return None
+    elif last_modified is None or since is None or \
+            last_modified.replace(microsecond=0) > since.replace(tzinfo=None):
+        return None
+    return response
+
+
+def set_cache_headers(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.vary.add('Cookie')
+    if current_user.is_anonymous and '_flashes' not in session:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['FLASKY_HTTP_MAX_AGE']
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
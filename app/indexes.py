@@ -0,0 +1,86 @@
+from datetime import datetime
+from bson import ObjectId
+from mongoengine.queryset.visitor import Q
+from .models import Role, User, Post, Follow
+from .search import SearchTerm, SearchStats, SearchEntry
+from .timeline import Timeline
+
+DOCUMENTS = [Role, User, Post, Follow, Timeline, SearchTerm, SearchStats,
+             SearchEntry]
+
+
+def _keyset(queryset):
+    return _keyset_by(queryset, 'timestamp')
+
+
+def _keyset_by(queryset, key):
+    now, oid = datetime.utcnow(), ObjectId()
+    return queryset.filter(Q(**{key + '__lt': now}) | Q(**{key: now, 'id__lt': oid})) \
+        .order_by('-' + key, '-id')
+
+
+# One entry per query issued by main/views.py, auth/views.py and the models
+# they call, with placeholder values for the parameters.
+QUERY_SHAPES = [
+    ('main.index', lambda: _keyset(Post.objects)),
+    ('main.index timeline', lambda: Timeline.objects(owner = ObjectId())),
+    ('main.index celebrities', lambda: Follow.objects(celebrity = True,
+                                                      follower = ObjectId())),
+    ('main.index celebrity posts',
+     lambda: _keyset(Post.objects(author__in = [ObjectId()]))),
+    ('main.index followed posts', lambda: Post.objects(id__in = [ObjectId()])),
+    ('main.user profile', lambda: User.objects(username = 'x')),
+    ('main.user posts', lambda: _keyset(Post.objects(author = ObjectId()))),
+    ('main.post', lambda: Post.objects(idx = 'x')),
+    ('main.edit', lambda: Post.objects(idx = 'x')),
+    ('timeline fan-out', lambda: Follow.objects(followed = ObjectId())),
+    ('timeline rebuild', lambda: Follow.objects(follower = ObjectId())),
+    ('main.followers', lambda: _keyset(Follow.objects(followed = ObjectId()))),
+    ('main.followed_by', lambda: _keyset(Follow.objects(follower = ObjectId()))),
+    ('main.user is_following', lambda: Follow.objects(follower = ObjectId(),
+                                                      followed = ObjectId())),
+    ('following_ids', lambda: Follow.objects(follower = ObjectId(),
+                                             followed__in = [ObjectId()])),
+    ('main.search', lambda: SearchTerm.objects(term__in = ['x'])),
+    ('search unindex', lambda: SearchEntry.objects(post = ObjectId())),
+    ('api.get_users', lambda: _keyset_by(User.objects, 'member_since')),
+    ('api export', lambda: Post.objects(id__gt = ObjectId()).order_by('id')),
+    ('auth.login', lambda: User.objects(email = 'x')),
+    ('auth.register username', lambda: User.objects(username = 'x')),
+    ('load_user', lambda: User.objects(id = ObjectId())),
+]
+
+
+def sync_indexes():
+    """Build the declared indexes of every document in the background."""
+    built = {}
+    for document in DOCUMENTS:
+        document.ensure_indexes()
+        built[document._get_collection_name()] = \
+            sorted(document._get_collection().index_information())
+    return built
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            for stage in _stages(value):
+                yield stage
+    elif isinstance(plan, list):
+        for item in plan:
+            for stage in _stages(item):
+                yield stage
+
+
+def audit_queries():
+    """Explain every known query shape and return the ones that scan the
+    whole collection, as (name, explain output) pairs."""
+    scans = []
+    for name, build in QUERY_SHAPES:
+        explain = build().explain()
+        winning = explain.get('queryPlanner', explain).get('winningPlan', explain)
+        if 'COLLSCAN' in set(_stages(winning)):
+            scans.append((name, explain))
+    return scans
@@ -0,0 +1,80 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.write_concern import WriteConcern
+
+
+class LastSeenTracker(object):
+    """Buffers User.last_seen timestamps and writes them in bulk.
+
+    A user is recorded at most once per FLASKY_LAST_SEEN_INTERVAL seconds,
+    and the buffer is flushed every FLASKY_LAST_SEEN_FLUSH seconds by a
+    background thread and once more when the process exits.
+    """
+
+    def __init__(self, app=None):
+        self._pending = {}
+        self._written = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = timedelta(seconds=app.config['FLASKY_LAST_SEEN_INTERVAL'])
+        self.flush_every = app.config['FLASKY_LAST_SEEN_FLUSH']
+        # losing a batch only makes last_seen a little older
+        self.write_concern = WriteConcern(w=app.config['FLASKY_LAST_SEEN_WRITE_CONCERN'])
+        atexit.register(self.flush)
+
+    def touch(self, user_id, when=None):
+        when = when or datetime.utcnow()
+        with self._lock:
+            last = self._written.get(user_id)
+            if last is not None and when - last < self.interval:
+                return
+            self._written[user_id] = when
+            self._pending[user_id] = when
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        # started lazily so every forked worker process runs its own flusher
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run, name='last-seen-flush')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_every)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Could not flush last_seen updates')
+
+    def _collection(self):
+        from .models import User
+        return User._get_collection().with_options(
+            write_concern=self.write_concern)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            horizon = datetime.utcnow() - self.interval
+            self._written = dict((k, v) for k, v in self._written.items()
+                                 if v > horizon)
+        if not pending:
+            return 0
+        requests = [UpdateOne({'_id': user_id}, {'$set': {'last_seen': when}})
+                    for user_id, when in pending.items()]
+        self._collection().bulk_write(requests, ordered=False)
+        return len(requests)
@@ -1,3 +1,7 @@
+try:
+    from queue import Full
+except ImportError:
+    from Queue import Full
 from flask import render_template
 from . import main
 
@@ -10,3 +14,9 @@ def page_not_found(e):
 @main.app_errorhandler(500)
 def internal_server_error(e):
     return render_template('500.html'), 500
+
+
+@main.app_errorhandler(Full)
+def service_unavailable(e):
+    # the password hasher or the mail queue is saturated
+    return render_template('503.html'), 503, {'Retry-After': '5'}
@@ -1,13 +1,19 @@
+from datetime import datetime
 from flask import render_template, redirect, url_for, abort, flash, request, current_app, \
-    make_response
+    make_response, jsonify
 from flask_login import login_required, current_user
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm
-from .. import db
-from ..models import Role, User, Post, Permission
-from ..decorators import admin_required
+from .. import db, response_cache, profiler, read_router
+from ..models import Role, User, Post, Follow, Permission
+from ..decorators import admin_required, permission_required
+from ..timeline import fan_out, timeline_page
+from ..search import index_post, search_posts
+from ..pagination import cursor_paginate, cached_count
+from ..http_cache import latest, make_etag, not_modified, set_cache_headers
 
 @main.route('/', methods = ['GET', 'POST'])
+@response_cache.cached('posts')
 def index():
     form = PostForm()
     #Post.generate_fake()
@@ -17,41 +23,64 @@ def index():
                     author = current_user._get_current_object()
                     )
         post.save()
+        fan_out(post)
+        index_post(post)
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type = int)
 
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
+    per_page = current_app.config['FLASKY_POSTS_PER_PAGE']
     if show_followed:
-        post = current_user.followed_posts
+        pagination = timeline_page(current_user, per_page)
     else:
-        post = Post
-
-    pagination = post.objects.order_by('-timestamp').paginate(page,
-                                                              per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-                                                              error_out=False)
-    posts = pagination.items
-    for post in posts:
-        post.idx = str(post.id)
-        #print post.idx
-        post.save()
-    #print len(posts)
+        pagination = cursor_paginate(read_router.reads(Post.objects), per_page,
+                                     total = cached_count(Post.objects, 'posts'))
+    posts = Post.prefetch_authors(pagination.items)
     return render_template('index.html', form = form, posts = posts, show_followed=show_followed,
                            pagination = pagination)
 
 @main.route('/user/<username>')
+@response_cache.cached('user:{username}')
 def user(username):
-    user = User.objects(username = username).first()
-    page = request.args.get('page', 1, type = int)
-    pagination = Post.objects(author = user).order_by('-timestamp').paginate(page,
-                                                              per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-                                                              error_out=False)
-    posts = pagination.items
-    for post in posts:
-        post.idx = str(post.id)
-        post.save()
-    return render_template('user.html', user = user, posts = posts, pagination = pagination)
+    stamp = User.objects(username = username) \
+        .only('id', 'version', 'updated_at', 'last_seen').first()
+    if stamp is None:
+        abort(404)
+    etag = make_etag('user', stamp.id, stamp.version, stamp.last_seen)
+    # last_seen is written in bulk without touching updated_at
+    last_modified = latest(stamp.updated_at, stamp.last_seen)
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    # the stamp always comes from the primary; a page read from a lagging
+    # secondary must not be sent with validators that claim it is current
+    secondary = read_router.use_secondary()
+    user = read_router.reads(User.objects(id = stamp.id)).first() or \
+        User.objects(id = stamp.id).first()
+    query = read_router.reads(Post.objects(author = user))
+    pagination = cursor_paginate(query, current_app.config['FLASKY_POSTS_PER_PAGE'],
+                                 total = cached_count(query, 'posts:%s' % username))
+    posts = Post.prefetch_authors(pagination.items, known = [user])
+    response = make_response(render_template('user.html', user = user, posts = posts,
+                                             pagination = pagination))
+    if secondary:
+        return response
+    return set_cache_headers(response, etag, last_modified)
+
+@main.route('/search')
+@response_cache.cached('posts')
+def search():
+    q = request.args.get('q', '').strip()
+    pagination = None
+    posts = []
+    if q:
+        # terms keep only their newest FLASKY_SEARCH_POSTINGS posts, so a
+        # common word finds recent posts but not older ones
+        pagination = search_posts(q, current_app.config['FLASKY_POSTS_PER_PAGE'])
+        posts = Post.prefetch_authors(pagination.items)
+    return render_template('search.html', q = q, posts = posts,
+                           pagination = pagination)
 
 @main.route('/edit-profile', methods = ['GET', 'POST'])
 @login_required
@@ -80,6 +109,7 @@ def edit(id):
     if form.validate_on_submit():
         post.body = form.body.data
         post.save()
+        index_post(post)
         flash('The post has been updated')
         id = post.idx
         return redirect(url_for('.post', idx = id))
@@ -114,9 +144,64 @@ def edit_profile_admin(id):
 
 
 @main.route('/post/<string:idx>')
+@response_cache.cached('post:{idx}')
 def post(idx):
-    post = Post.objects(idx = idx).first()
-    return render_template('post.html', posts = [post])
+    stamp = Post.objects(idx = idx) \
+        .only('id', 'version', 'edited_at', 'timestamp', 'author').first()
+    if stamp is None:
+        abort(404)
+    author = getattr(stamp._data.get('author'), 'id', None)
+    etag = make_etag('post', stamp.id, stamp.version,
+                     response_cache.generation('author:%s' % author))
+    last_modified = stamp.edited_at or stamp.timestamp
+    response = not_modified(etag, last_modified)
+    if response is not None:
+        return response
+    secondary = read_router.use_secondary()
+    post = read_router.reads(Post.objects(id = stamp.id)).first() or \
+        Post.objects(id = stamp.id).first()
+    response = make_response(render_template('post.html',
+                                             posts = Post.prefetch_authors([post])))
+    if secondary:
+        return response
+    return set_cache_headers(response, etag, last_modified)
+
+FEED_FIELDS = ('idx', 'body', 'body_html', 'timestamp', 'edited_at', 'author')
+
+def _atom(title, feed_url, page_url, query, known = ()):
+    posts = list(query.only(*FEED_FIELDS).order_by('-timestamp', '-id')
+                 .limit(current_app.config['FLASKY_FEED_SIZE']))
+    Post.prefetch_authors(posts, known = known)
+    response_cache.depends(*set('author:%s' % getattr(p._data.get('author'), 'id', None)
+                                for p in posts))
+    updated = max([p.edited_at or p.timestamp for p in posts] or
+                  [datetime.utcnow()])
+    response = make_response(render_template(
+        'feed.xml', title = title, feed_url = feed_url, page_url = page_url,
+        posts = posts, updated = updated))
+    response.mimetype = 'application/atom+xml'
+    response.last_modified = updated
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['FLASKY_HTTP_MAX_AGE']
+    response.add_etag()
+    return response.make_conditional(request)
+
+@main.route('/feed.atom')
+@response_cache.cached_for_all('posts')
+def feed():
+    return _atom('Recent posts', url_for('.feed', _external = True),
+                 url_for('.index', _external = True), Post.objects)
+
+@main.route('/user/<username>/feed.atom')
+@response_cache.cached_for_all('user:{username}')
+def user_feed(username):
+    user = User.objects(username = username).only('id', 'username').first()
+    if user is None:
+        abort(404)
+    return _atom('Posts by %s' % username,
+                 url_for('.user_feed', username = username, _external = True),
+                 url_for('.user', username = username, _external = True),
+                 Post.objects(author = user.id), known = [user])
 
 @main.route('/all')
 @login_required
@@ -132,18 +217,53 @@ def show_followed():
     resp.set_cookie('show_followed', '1', max_age=30*24*60*60)
     return resp
 
+@main.route('/follow/<username>')
+@login_required
+@permission_required(Permission.FOLLOW)
+def follow(username):
+    user = User.objects(username=username).first()
+    if user is None:
+        flash('Invalid user.')
+        return redirect(url_for('.index'))
+    read_router.stick_to_primary()
+    if not current_user.follow(user):
+        flash('You are already following this user.')
+        return redirect(url_for('.user', username=username))
+    flash('You are now following %s.' % username)
+    return redirect(url_for('.user', username=username))
+
+@main.route('/unfollow/<username>')
+@login_required
+@permission_required(Permission.FOLLOW)
+def unfollow(username):
+    user = User.objects(username=username).first()
+    if user is None:
+        flash('Invalid user.')
+        return redirect(url_for('.index'))
+    read_router.stick_to_primary()
+    if not current_user.unfollow(user):
+        flash('You are not following this user.')
+        return redirect(url_for('.user', username=username))
+    flash('You are not following %s anymore.' % username)
+    return redirect(url_for('.user', username=username))
+
+def _hydrate_follows(edges, field):
+    users = User.objects.in_bulk([getattr(edge, field) for edge in edges])
+    return [{'user': users[getattr(edge, field)], 'timestamp': edge.timestamp}
+            for edge in edges if getattr(edge, field) in users]
+
 @main.route('/followers/<username>')
 def followers(username):
     user = User.objects(username=username).first()
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.objects.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
-    follows = [{'user': user, 'timestamp': item.timestamp}
-               for item in pagination.items]
+    query = read_router.reads(
+        Follow.objects(followed=user.id).only('follower', 'timestamp'))
+    pagination = cursor_paginate(query,
+                                 current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+                                 total=user.followers_count)
+    follows = _hydrate_follows(pagination.items, 'follower')
     return render_template('followers.html', user=user, title="Followers of",
                            endpoint='.followers', pagination=pagination,follows=follows)
 @main.route('/followed-by/<username>')
@@ -152,11 +272,28 @@ def followed_by(username):
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.objects.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
-    follows = [{'user': user, 'timestamp': item.timestamp}
-               for item in pagination.items]
+    query = read_router.reads(
+        Follow.objects(follower=user.id).only('followed', 'timestamp'))
+    pagination = cursor_paginate(query,
+                                 current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+                                 total=user.followed_count)
+    follows = _hydrate_follows(pagination.items, 'followed')
     return render_template('followers.html', user=user, title="Followed by",
-                           endpoint='.followed_by', pagination=pagination,follows=follows)
\ No newline at end of file
+                           endpoint='.followed_by', pagination=pagination,follows=follows)
+
+@main.route('/_stats')
+@login_required
+@admin_required
+def stats():
+    if not profiler.enabled:
+        abort(404)
+    return jsonify(profiler.stats())
+
+@main.route('/_stats/slow')
+@login_required
+@admin_required
+def slow_endpoints():
+    if not profiler.enabled:
+        abort(404)
+    return render_template('slow_endpoints.html', endpoints=profiler.slowest(20),
+                           caches=profiler.stats()['caches'])
\ No newline at end of file
@@ -1,12 +1,15 @@
 from datetime import datetime
 import hashlib
-from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app, request
 from flask_login import UserMixin, AnonymousUserMixin
-from . import db, login_manager
+from . import db, login_manager, user_cache, response_cache, last_seen, \
+    profiler, password_hasher
+from .cache import LRUCache
 import bleach
 from markdown import markdown
+from bson import ObjectId
+from mongoengine import signals, NotUniqueError
 
 
 class Permission:
@@ -16,6 +19,16 @@ class Permission:
     MODERATE_COMMENTS = 0X08
     ADMINISTER = 0x80
 
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                'h1', 'h2', 'h3', 'p']
+
+# Stored next to every rendered body; changing the renderer or the tag
+# whitelist changes it, which marks existing body_html as stale.
+BODY_HTML_VERSION = hashlib.md5(repr(
+    ('markdown+bleach', bleach.__version__, ALLOWED_TAGS)
+).encode('utf-8')).hexdigest()[:12]
+
 class Role(db.Document):
     __tablename__ = 'roles'
     #id = db.Column(db.Integer, primary_key=True)
@@ -46,16 +59,77 @@ class Role(db.Document):
             role.permissions = roles[r][0]
             role.default = roles[r][1]
             role.save()
+        Role.reload_table()
+
+    @staticmethod
+    def table():
+        """The roles collection as a RoleTable, loaded once per process."""
+        global _role_table
+        if _role_table is None:
+            roles = list(Role.objects)
+            if not roles:
+                Role.insert_roles()
+                roles = list(Role.objects)
+            _role_table = RoleTable(roles)
+        return _role_table
+
+    @staticmethod
+    def reload_table():
+        global _role_table
+        _role_table = None
 
     def __repr__(self):
         return '<Role %r>' % self.name
 
-# class Follow(db.EmbeddedDocument):
-#     __tablename__ = 'follows'
-#     timestamp = db.DateTimeField(default = datetime.utcnow())
-#     #user = db.ReferenceField(User)
-#     #follower_id = db.StringField()
-#     #user_id = db.StringField()
+
+class RoleTable(object):
+    """Read-only snapshot of the roles collection.
+
+    Roles change only on deployment, so permission checks read this table
+    instead of dereferencing User.role on every request.
+    """
+    def __init__(self, roles):
+        self._roles = tuple(roles)
+        self._permissions = dict((r.id, r.permissions or 0) for r in roles)
+
+    def permissions(self, role_id):
+        return self._permissions.get(role_id, 0)
+
+    def default(self):
+        for role in self._roles:
+            if role.default:
+                return role
+
+    def with_permissions(self, permissions):
+        for role in self._roles:
+            if role.permissions == permissions:
+                return role
+
+_role_table = None
+
+_gravatar_urls = LRUCache(maxsize = 10000)
+
+class Follow(db.Document):
+    __tablename__ = 'follows'
+    follower = db.ObjectIdField(required = True)
+    followed = db.ObjectIdField(required = True)
+    timestamp = db.DateTimeField(default = datetime.utcnow)
+    # set on edges whose followed user is too popular to fan out to
+    celebrity = db.BooleanField()
+    meta = {
+        'indexes': [
+            {'fields': ['follower', 'followed'], 'unique': True},
+            # listing indexes, ordered like the follower pages and covering
+            # the user on the other end of the edge
+            {'fields': ['followed', '-timestamp', '-id', 'follower']},
+            {'fields': ['follower', '-timestamp', '-id', 'followed']},
+            # only the flagged edges; a sparse compound index would still
+            # hold an entry for every edge
+            {'fields': ['follower', 'celebrity', 'followed'],
+             'partialFilterExpression': {'celebrity': True}}
+        ],
+        'index_background': True
+    }
 
 class User(UserMixin, db.Document):
     __tablename__ = 'users'
@@ -63,53 +137,55 @@ class User(UserMixin, db.Document):
     email = db.StringField(max_length = 64, unique = True)
     username = db.StringField(max_length = 64, unique = True)
     #role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
-    password_hash = db.StringField(max_length = 128)
+    password_hash = db.StringField(max_length = 256)
     confirmed = db.BooleanField(default = True)
     role = db.ReferenceField(Role)
     location = db.StringField(max_length = 64)
     avatar_hash = db.StringField(max_length = 64)
     last_seen = db.DateTimeField()
-    member_since = db.DateTimeField(default = datetime.utcnow())
+    member_since = db.DateTimeField(default = datetime.utcnow)
     about_me = db.StringField()
-    followers = db.ListField(db.StringField())
-    followed = db.ListField(db.StringField())
+    followers_count = db.IntField(default = 0)
+    followed_count = db.IntField(default = 0)
+    # bumped whenever anything shown on the profile page changes
+    version = db.IntField(default = 0)
+    updated_at = db.DateTimeField()
     #posts = db.ReferenceField(Post)
+    meta = {
+        'indexes': [
+            # the API's user listing
+            {'fields': ['-member_since', '-id']}
+        ],
+        'index_background': True,
+        # documents written before the Follow collection still carry
+        # followers/followed arrays until migrate_follow_lists removes them
+        'strict': False
+    }
 
     @staticmethod
     def generate_fake(count=100):
-        from random import seed, randint
-        import forgery_py
-
-        seed()
-        for i in range(count):
-            u = User(forgery_py.internet.email_address(),
-                     username=forgery_py.internet.user_name(True),
-                     password=forgery_py.lorem_ipsum.word(),
-                     confirmed=True,
-                     name=forgery_py.full_name(),
-                     location=forgery_py.address.city(),
-                     about_me=forgery_py.lorem_ipsum.sentence(),
-                     member_since=forgery_py.date.date(True)
-                     )
-            u.save()
+        from .fake import add_users
+        return add_users(count)
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        Role.insert_roles()
-        if self.role is None:
-            if self.email == current_app.config['FLASKY_ADMIN']:
-                self.role = Role.objects(permissions = 0xff).first()
+        # Only new users get a role assigned; documents loaded from the
+        # database already carry theirs.
+        if self._created and self._data.get('role') is None:
+            roles = Role.table()
+            if self.email is not None and \
+                    self.email == current_app.config['FLASKY_ADMIN']:
+                self.role = roles.with_permissions(0xff)
             if self.role is None:
-                self.role = Role.objects(default = True).first()
-            self.save()
+                self.role = roles.default()
 
-        if self.email is not None and self.avatar_hash is None:
+        if self._created and self.email is not None and self.avatar_hash is None:
             self.avatar_hash = hashlib.md5(self.email.encode('utf-8')).hexdigest()
 
 
     def get_id(self):
         try:
-            return unicode(self.id)
+            return u'%s' % self.id
         except AttributeError:
             raise NotImplementedError('No `id` attribute - override `get_id`')
 
@@ -119,10 +195,19 @@ class User(UserMixin, db.Document):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        # upgrade hashes made with an older method or work factor while
+        # the plain password is at hand
+        if password_hasher.needs_rehash(self.password_hash):
+            self.password_hash = password_hasher.hash(password)
+            User.objects(id = self.id).update_one(
+                set__password_hash = self.password_hash)
+            user_cache.invalidate(self.id)
+        return True
 
     def generate_confirmation_token(self, expiration = 3600):
         s = Serializer(current_app.config['SECRET_KEY'], expiration)
@@ -156,6 +241,19 @@ class User(UserMixin, db.Document):
         self.save()
         return True
 
+    def generate_auth_token(self, expiration = 3600):
+        s = Serializer(current_app.config['SECRET_KEY'], expiration)
+        return s.dumps({'id': str(self.id)}).decode('ascii')
+
+    @staticmethod
+    def verify_auth_token(token):
+        s = Serializer(current_app.config['SECRET_KEY'])
+        try:
+            data = s.loads(token)
+        except:
+            return None
+        return load_user(data.get('id'))
+
     def generate_email_change_token(self, new_email, expiration = 3600):
         s = Serializer(current_app.config['SECRET_KEY'], expiration)
         return s.dumps({'change_email': str(self.id), 'new_email': new_email})
@@ -181,49 +279,124 @@ class User(UserMixin, db.Document):
         return True
 
     def can(self, permissions):
-        return self.role is not None and \
-               (self.role.permissions & permissions) == permissions
+        role = self._data.get('role')
+        if role is None:
+            return False
+        role_id = getattr(role, 'id', role)
+        return (Role.table().permissions(role_id) & permissions) == permissions
+
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        self.save()
+        last_seen.touch(self.id)
 
     def gravatar(self, size = 100, default = 'idention', rating = 'g'):
-        if request.is_secure:
-            url = 'https://secure.gravatar.com/avatar'
-        else:
-            url = 'http://www.gravatar.com/avatar'
+        scheme = 'https' if request.is_secure else 'http'
+        # users missing from backfill_avatar_hashes() are keyed by email
+        key = (self.avatar_hash or self.email, size, scheme, default, rating)
+        url = _gravatar_urls.get(key)
+        if url is None:
+            if scheme == 'https':
+                base = 'https://secure.gravatar.com/avatar'
+            else:
+                base = 'http://www.gravatar.com/avatar'
+            hash = self.avatar_hash or hashlib.md5(
+                self.email.encode('utf-8')
+            ).hexdigest()
+            url = '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
+                url=base, hash=hash, size=size, default=default, rating=rating)
+            _gravatar_urls.set(key, url)
+        return url
 
-        hash = self.avatar_hash or hashlib.md5(
-            self.email.encode('utf-8')
-        ).hexdigest()
-        return '{url}/{hash}?s={size}&d={default}&r={rating}'.format(
-            url=url, hash=hash, size=size, default=default, rating=rating)
+    @staticmethod
+    def backfill_avatar_hashes():
+        count = 0
+        for user in User.objects(avatar_hash = None, email__ne = None) \
+                .only('id', 'email'):
+            User.objects(id = user.id).update_one(
+                set__avatar_hash = hashlib.md5(user.email.encode('utf-8')).hexdigest())
+            user_cache.invalidate(user.id)
+            count += 1
+        return count
+
+    def _add_follow_counts(self, user, delta):
+        now = datetime.utcnow()
+        User.objects(id = self.id).update_one(inc__followed_count = delta,
+                                              inc__version = 1,
+                                              set__updated_at = now)
+        User.objects(id = user.id).update_one(inc__followers_count = delta,
+                                              inc__version = 1,
+                                              set__updated_at = now)
+        user_cache.invalidate(self.id)
+        user_cache.invalidate(user.id)
+        response_cache.bump('user:%s' % self.username, 'user:%s' % user.username)
 
     def follow(self, user):
-        if not self.is_following(user):
-            User.objects(followed__in = user.id).update_one(push__followed = user)
+        from .timeline import is_celebrity, on_follow
+        celebrity = is_celebrity(user) or None
+        try:
+            Follow(follower = self.id, followed = user.id,
+                   celebrity = celebrity).save()
+        except NotUniqueError:
+            return False
+        self._add_follow_counts(user, 1)
+        if not celebrity:
+            on_follow(self, user)
+        return True
 
     def unfollow(self, user):
-        f = User.objects(followed__in = user.id)[0]
-        if f:
-            f.update_one(pull__followed = user)
+        from .timeline import on_unfollow
+        if not Follow.objects(follower = self.id, followed = user.id).delete():
+            return False
+        self._add_follow_counts(user, -1)
+        on_unfollow(self, user)
+        return True
 
     def is_following(self, user):
-        return User.objects(followed__in = user.id).first() is not None
+        return Follow.objects(follower = self.id, followed = user.id) \
+            .only('id').first() is not None
 
     def is_followed_by(self, user):
-        return User.objects(follower__in = user.id).first() is not None
+        return user.is_following(self)
+
+    def following_ids(self, user_ids):
+        """The subset of ``user_ids`` this user follows, in one query."""
+        return set(Follow.objects(follower = self.id,
+                                  followed__in = list(user_ids)).scalar('followed'))
+
+    @staticmethod
+    def migrate_follow_lists():
+        """Turn the old followers/followed arrays into Follow edges."""
+        users = User._get_collection()
+        follows = Follow._get_collection()
+        legacy = {'$or': [{'followers': {'$exists': True}},
+                          {'followed': {'$exists': True}}]}
+        edges = set()
+        for doc in users.find(legacy, {'followers': 1, 'followed': 1}):
+            for f in doc.get('followed') or []:
+                edges.add((doc['_id'], ObjectId(f)))
+            for f in doc.get('followers') or []:
+                edges.add((ObjectId(f), doc['_id']))
+        if not edges:
+            users.update_many(legacy, {'$unset': {'followers': '', 'followed': ''}})
+            return 0
+        for follower, followed in edges:
+            follows.update_one({'follower': follower, 'followed': followed},
+                               {'$setOnInsert': {'timestamp': datetime.utcnow()}},
+                               upsert = True)
+        for field, key in (('followed_count', '$follower'),
+                           ('followers_count', '$followed')):
+            for row in follows.aggregate([{'$group': {'_id': key,
+                                                      'n': {'$sum': 1}}}]):
+                users.update_one({'_id': row['_id']}, {'$set': {field: row['n']}})
+        users.update_many(legacy, {'$unset': {'followers': '', 'followed': ''}})
+        return len(edges)
 
     @property
     def posts(self):
-        return Post.objects
+        return Post.objects(author = self)
 
-    @property
-    def followed_posts(self):
-        return Post
     def __repr__(self):
         return '<User %r>' % self.username
 
@@ -232,36 +405,91 @@ class Post(db.Document):
     __tablename__ = 'posts'
     body = db.StringField()
     body_html = db.StringField()
-    timestamp = db.DateTimeField(default = datetime.utcnow())
+    body_html_version = db.StringField()
+    timestamp = db.DateTimeField(default = datetime.utcnow)
     author = db.ReferenceField(User)
     idx = db.StringField()
+    version = db.IntField(default = 0)
+    edited_at = db.DateTimeField()
+    meta = {
+        'indexes': [
+            {'fields': ['-timestamp', '-id']},
+            {'fields': ['author', '-timestamp', '-id']},
+            {'fields': ['idx'], 'unique': True, 'sparse': True}
+        ],
+        'index_background': True
+    }
     # @queryset_manager
     # def objects(doc_cls, queryset):
     #     return queryset.order_by('-timestamp')
 
     @staticmethod
     def generate_fake(count = 100):
-        from random import seed, randint
-        import forgery_py
-
-        seed()
-        user_count = len(User.objects)
-        for i in range(count):
-            u = User.objects[randint(0, user_count - 1)]
-            p = Post(body = forgery_py.lorem_ipsum.sentences(randint(1, 5)),
-                     timestamp = forgery_py.date.date(True),
-                     author = u
-                     )
-            p.save()
+        from .fake import add_posts
+        return add_posts(count)
+
+    def save(self, *args, **kwargs):
+        # Allocate the id up front so the permalink is written together with
+        # the post instead of being patched in later by the read views.
+        if self.id is None:
+            self.id = ObjectId()
+        if self.idx is None:
+            self.idx = str(self.id)
+        return super(Post, self).save(*args, **kwargs)
+
+    @staticmethod
+    def backfill_idx():
+        count = 0
+        for post in Post.objects(idx = None).only('id'):
+            Post.objects(id = post.id).update_one(set__idx = str(post.id))
+            count += 1
+        return count
+
+    @staticmethod
+    def prefetch_authors(posts, known = ()):
+        """Load the authors of a list of posts with a single $in query so
+        templates don't dereference them one post at a time."""
+        authors = dict((u.id, u) for u in known)
+        refs = [getattr(p._data.get('author'), 'id', None) for p in posts]
+        missing = set(r for r in refs if r is not None) - set(authors)
+        if missing:
+            authors.update(User.objects.in_bulk(list(missing)))
+        for post, ref in zip(posts, refs):
+            if ref in authors:
+                post._data['author'] = authors[ref]
+        return posts
+
+    @staticmethod
+    def render_body(body):
+        with profiler.timer('markdown'):
+            return bleach.linkify(bleach.clean(
+                markdown(body or '', output_format = 'html'),
+                tags = ALLOWED_TAGS, strip = True
+            ))
+
     @staticmethod
-    def on_changed_body(targer, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format = 'html'),
-            tags = allowed_tags, strip = True
-        ))
+    def on_changed_body(sender, document, **kwargs):
+        if 'body' in document._get_changed_fields() or \
+                document.body_html_version != BODY_HTML_VERSION:
+            document.body_html = Post.render_body(document.body)
+            document.body_html_version = BODY_HTML_VERSION
+            document.version = (document.version or 0) + 1
+            document.edited_at = datetime.utcnow()
+
+    @staticmethod
+    def rerender_stale():
+        count = 0
+        stale = Post.objects(body_html_version__ne = BODY_HTML_VERSION) \
+            .only('id', 'body').batch_size(500)
+        for post in stale:
+            Post.objects(id = post.id).update_one(
+                set__body_html = Post.render_body(post.body),
+                set__body_html_version = BODY_HTML_VERSION,
+                inc__version = 1)
+            count += 1
+        return count
+
+signals.pre_save.connect(Post.on_changed_body, sender = Post)
 
 class AnonymousUser(AnonymousUserMixin):
     def can(self, permissions):
@@ -273,6 +501,56 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+def on_post_changed(sender, document, **kwargs):
+    author = document.author
+    User.objects(id = author.id).update_one(
+        inc__version = 1, set__updated_at = datetime.utcnow())
+    user_cache.invalidate(author.id)
+    response_cache.bump('posts', 'post:%s' % document.idx,
+                        'user:%s' % author.username)
+
+signals.post_save.connect(on_post_changed, sender = Post)
+signals.post_delete.connect(on_post_changed, sender = Post)
+
+
+def on_user_saving(sender, document, **kwargs):
+    document.version = (document.version or 0) + 1
+    document.updated_at = datetime.utcnow()
+
+signals.pre_save.connect(on_user_saving, sender = User)
+
+
+# the user fields pages show next to each of the user's posts
+AUTHOR_FIELDS = frozenset(['username', 'email', 'avatar_hash'])
+
+def on_user_changed(sender, document, **kwargs):
+    user_cache.invalidate(document.id)
+    tags = ['users', 'user:%s' % document.username]
+    changed = set(f.split('.')[0] for f in document._get_changed_fields())
+    # post_delete passes no 'created'
+    if 'created' not in kwargs or changed & AUTHOR_FIELDS:
+        tags.append('author:%s' % document.id)
+    response_cache.bump(*tags)
+
+signals.post_save.connect(on_user_changed, sender = User)
+signals.post_delete.connect(on_user_changed, sender = User)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.objects(id = user_id).first()
+    return user_cache.get(User, user_id,
+                          lambda: User.objects(id = user_id).first())
+
+
+@login_manager.request_loader
+def load_user_from_request(request):
+    # HTTP Basic credentials for API clients: an auth token with an empty
+    # password, or an email address and password
+    auth = request.authorization
+    if auth is None or not auth.username:
+        return None
+    if not auth.password:
+        return User.verify_auth_token(auth.username)
+    user = User.objects(email = auth.username).first()
+    if user is not None and user.verify_password(auth.password):
+        return user
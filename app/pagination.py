@@ -0,0 +1,116 @@
+import base64
+import binascii
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import abort, current_app, request
+from mongoengine.queryset.visitor import Q
+from .cache import LRUCache
+
+EPOCH = datetime(1970, 1, 1)
+
+# one entry per filtered listing, e.g. per user's posts
+_counts = LRUCache(maxsize=10000)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, id):
+    delta = value - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    raw = '%d:%s' % (micros, id)
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        micros, id = raw.decode('ascii').split(':', 1)
+        return EPOCH + timedelta(microseconds=int(micros)), ObjectId(id)
+    except (TypeError, ValueError, InvalidId, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def cached_count(queryset, key, ttl=None):
+    """Total for a listing, without counting on every request.
+
+    Unfiltered listings use the collection's metadata count; filtered ones
+    are counted at most once per FLASKY_COUNT_CACHE_TTL seconds per key.
+    """
+    if not queryset._query:
+        return queryset._collection.estimated_document_count()
+    count = lookup_count(key)
+    if count is None:
+        count = queryset.count()
+        remember_count(key, count, ttl)
+    return count
+
+
+def lookup_count(key):
+    return _counts.get(key)
+
+
+def remember_count(key, count, ttl=None):
+    if ttl is None:
+        ttl = current_app.config['FLASKY_COUNT_CACHE_TTL']
+    _counts.set(key, count, ttl)
+
+
+class CursorPagination(object):
+    """Keyset pagination over (key, id), newest first.
+
+    ``before`` returns the page following an item, ``after`` the page
+    preceding it, so any page costs one indexed range read.
+    """
+
+    def __init__(self, queryset, per_page, before=None, after=None,
+                 key='timestamp', total=None):
+        self.per_page = per_page
+        self.key = key
+        self.total = total
+        if after is not None:
+            value, id = decode_cursor(after)
+            query = queryset.filter(
+                Q(**{key + '__gt': value}) | Q(**{key: value, 'id__gt': id})
+            ).order_by(key, 'id')
+        else:
+            if before is not None:
+                value, id = decode_cursor(before)
+                queryset = queryset.filter(
+                    Q(**{key + '__lt': value}) | Q(**{key: value, 'id__lt': id}))
+            query = queryset.order_by('-' + key, '-id')
+        items = list(query.limit(per_page + 1))
+        more = len(items) > per_page
+        items = items[:per_page]
+        if after is not None:
+            items.reverse()
+            self.has_prev, self.has_next = more, True
+        else:
+            self.has_prev, self.has_next = before is not None, more
+        self.items = items
+
+    def _cursor(self, item):
+        return encode_cursor(getattr(item, self.key), item.id)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return self._cursor(self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return self._cursor(self.items[0])
+
+
+def cursor_paginate(queryset, per_page, key='timestamp', total=None):
+    """Build a CursorPagination from the ``before``/``after`` request args."""
+    try:
+        return CursorPagination(queryset, per_page,
+                                before=request.args.get('before'),
+                                after=request.args.get('after'),
+                                key=key, total=total)
+    except InvalidCursor:
+        abort(400)
@@ -0,0 +1,168 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, request, before_render_template, template_rendered
+from pymongo import monitoring
+
+
+class Histogram(object):
+    """Request timings for one endpoint in fixed millisecond buckets."""
+
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.totals = {}
+        self.max = 0.0
+
+    def add(self, sample):
+        wall = sample['wall_time']
+        i = 0
+        while i < len(self.BOUNDS) and wall > self.BOUNDS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.max = max(self.max, wall)
+        for name, value in sample.items():
+            self.totals[name] = self.totals.get(name, 0) + value
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile."""
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+        return 0.0
+
+    def to_dict(self):
+        means = dict(('mean_' + name, total / float(self.count))
+                     for name, total in self.totals.items())
+        means.update(count=self.count, max=self.max,
+                     p50=self.percentile(50), p95=self.percentile(95),
+                     p99=self.percentile(99))
+        return means
+
+
+class _CommandListener(monitoring.CommandListener):
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.profiler.record_command(event.duration_micros)
+
+    def failed(self, event):
+        self.profiler.record_command(event.duration_micros)
+
+
+class Profiler(object):
+    """Opt-in per-request instrumentation, enabled by FLASKY_PROFILE.
+
+    Counts MongoDB commands through pymongo command monitoring and times
+    them, the outermost template renders and Markdown rendering. In debug
+    mode the figures are added to each response as X-* headers; they are
+    always aggregated per endpoint for the /_stats views.
+    """
+
+    _listener = None
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.endpoints = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['FLASKY_PROFILE']
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        # must be registered before the MongoClient is created
+        if Profiler._listener is None:
+            Profiler._listener = _CommandListener(self)
+            monitoring.register(Profiler._listener)
+        Profiler._listener.profiler = self
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+
+    @property
+    def sample(self):
+        return getattr(self._local, 'sample', None)
+
+    def _start(self):
+        self._local.sample = {'wall_time': time.time(), 'db_queries': 0,
+                              'db_time': 0.0, 'template_time': 0.0,
+                              'markdown_time': 0.0}
+        self._local.render_depth = 0
+
+    def record_command(self, micros):
+        sample = self.sample
+        if sample is not None:
+            sample['db_queries'] += 1
+            sample['db_time'] += micros / 1000.0
+
+    def _template_started(self, sender, template, context, **extra):
+        if self.sample is not None:
+            if self._local.render_depth == 0:
+                self._local.render_started = time.time()
+            self._local.render_depth += 1
+
+    def _template_finished(self, sender, template, context, **extra):
+        sample = self.sample
+        if sample is not None:
+            self._local.render_depth -= 1
+            if self._local.render_depth == 0:
+                sample['template_time'] += \
+                    (time.time() - self._local.render_started) * 1000
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            sample = self.sample
+            if sample is not None:
+                key = name + '_time'
+                sample[key] = sample.get(key, 0.0) + (time.time() - start) * 1000
+
+    def _finish(self, response):
+        sample = self.sample
+        if sample is None:
+            return response
+        self._local.sample = None
+        sample['wall_time'] = (time.time() - sample['wall_time']) * 1000
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            self.endpoints.setdefault(endpoint, Histogram()).add(sample)
+        if current_app.debug:
+            response.headers['X-Request-Time'] = '%.1fms' % sample['wall_time']
+            response.headers['X-DB-Queries'] = str(sample['db_queries'])
+            response.headers['X-DB-Time'] = '%.1fms' % sample['db_time']
+            response.headers['X-Template-Time'] = '%.1fms' % sample['template_time']
+            response.headers['X-Markdown-Time'] = '%.1fms' % sample['markdown_time']
+        return response
+
+    def stats(self):
+        from . import user_cache, response_cache
+        with self._lock:
+            endpoints = dict((name, h.to_dict())
+                             for name, h in self.endpoints.items())
+        return {'endpoints': endpoints,
+                'caches': {'user': user_cache.stats(),
+                           'response': response_cache.stats()}}
+
+    def slowest(self, count=10):
+        endpoints = self.stats()['endpoints']
+        return sorted(endpoints.items(), key=lambda item: item[1]['p95'],
+                      reverse=True)[:count]
@@ -0,0 +1,246 @@
+import base64
+import binascii
+import heapq
+import math
+import re
+from collections import Counter
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import abort, current_app, request
+from pymongo import UpdateOne
+from . import db
+from .pagination import InvalidCursor
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+# CJK text has no spaces between words, so it is indexed as character pairs
+_CJK = re.compile(u'[\u3400-\u9fff\uf900-\ufaff]+')
+STOPWORDS = frozenset('a an and are as at be but by for if in into is it no '
+                      'not of on or such that the their then there these '
+                      'they this to was will with'.split())
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+class SearchTerm(db.Document):
+    # One document per term. ``df`` counts every post containing the term;
+    # ``postings`` keeps only the newest FLASKY_SEARCH_POSTINGS of them, so
+    # a query reads a bounded number of candidates however many posts
+    # exist, and older posts cannot be found through a capped term.
+    term = db.StringField(primary_key = True)
+    df = db.IntField(default = 0)
+    postings = db.ListField(db.DictField())
+    meta = {'collection': 'search_terms'}
+
+
+class SearchEntry(db.Document):
+    # What indexing a post added to the terms and the stats, so removing it
+    # takes back exactly that even when its postings have been evicted
+    post = db.ObjectIdField(primary_key = True)
+    terms = db.ListField(db.StringField())
+    length = db.IntField(db_field = 'len')
+    meta = {'collection': 'search_entries'}
+
+
+class SearchStats(db.Document):
+    # totals over all indexed posts, for the idf and length normalization
+    name = db.StringField(primary_key = True)
+    docs = db.IntField(default = 0)
+    length = db.IntField(default = 0)
+    meta = {'collection': 'search_stats'}
+
+
+def tokenize(text):
+    tokens = []
+    for word in _WORD.findall((text or u'').lower()):
+        for part in _CJK.split(word):
+            if len(part) > 1 and part not in STOPWORDS:
+                tokens.append(part)
+        for run in _CJK.findall(word):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _terms(body, username):
+    return Counter(tokenize(body) + tokenize(username))
+
+
+def _update_stats(docs, length):
+    SearchStats._get_collection().update_one(
+        {'_id': 'posts'}, {'$inc': {'docs': docs, 'length': length}},
+        upsert = True)
+
+
+def unindex_post(post_id):
+    entry = SearchEntry._get_collection().find_one_and_delete({'_id': post_id})
+    if entry is None:
+        return
+    SearchTerm._get_collection().update_many(
+        {'_id': {'$in': entry['terms']}},
+        {'$pull': {'postings': {'post': post_id}}, '$inc': {'df': -1}})
+    _update_stats(-1, -entry['len'])
+
+
+def index_post(post):
+    """Replace the postings of a new or edited post with ones for its
+    current body and its author's username."""
+    unindex_post(post.id)
+    terms = _terms(post.body, post.author.username)
+    if not terms:
+        return
+    length = sum(terms.values())
+    limit = current_app.config['FLASKY_SEARCH_POSTINGS']
+    requests = []
+    for term, tf in terms.items():
+        posting = {'post': post.id, 'tf': tf, 'len': length,
+                   'timestamp': post.timestamp}
+        requests.append(UpdateOne(
+            {'_id': term},
+            {'$inc': {'df': 1},
+             '$push': {'postings': {'$each': [posting],
+                                    '$sort': {'timestamp': -1},
+                                    '$slice': limit}}},
+            upsert = True))
+    SearchTerm._get_collection().bulk_write(requests, ordered = False)
+    SearchEntry._get_collection().insert_one(
+        {'_id': post.id, 'terms': list(terms), 'len': length})
+    _update_stats(1, length)
+
+
+def rebuild_index(chunk = 1000):
+    """Rebuild the whole index from the posts collection."""
+    from .models import User, Post
+    limit = current_app.config['FLASKY_SEARCH_POSTINGS']
+    usernames = dict(User.objects.scalar('id', 'username'))
+    df = Counter()
+    newest = {}
+    docs = length = 0
+    SearchEntry.drop_collection()
+    entries = SearchEntry._get_collection()
+    batch = []
+    posts = Post.objects.only('id', 'body', 'author', 'timestamp') \
+        .no_dereference().batch_size(chunk)
+    for post in posts:
+        author = post._data.get('author')
+        terms = _terms(post.body, usernames.get(getattr(author, 'id', None)))
+        post_length = sum(terms.values())
+        docs += 1
+        length += post_length
+        batch.append({'_id': post.id, 'terms': list(terms), 'len': post_length})
+        if len(batch) == chunk:
+            entries.insert_many(batch, ordered = False)
+            batch = []
+        for term, tf in terms.items():
+            df[term] += 1
+            entry = (post.timestamp, post.id, tf, post_length)
+            heap = newest.setdefault(term, [])
+            if len(heap) < limit:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+    if batch:
+        entries.insert_many(batch, ordered = False)
+    SearchTerm.drop_collection()
+    SearchStats.drop_collection()
+    collection = SearchTerm._get_collection()
+    batch = []
+    for term, heap in newest.items():
+        postings = [{'post': post_id, 'tf': tf, 'len': post_length,
+                     'timestamp': timestamp}
+                    for timestamp, post_id, tf, post_length
+                    in sorted(heap, reverse = True)]
+        batch.append({'_id': term, 'df': df[term], 'postings': postings})
+        if len(batch) == chunk:
+            collection.insert_many(batch, ordered = False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered = False)
+    _update_stats(docs, length)
+    return docs
+
+
+def _encode(score, id):
+    raw = '%r:%s' % (score, id)
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def _decode(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        score, id = raw.decode('ascii').split(':', 1)
+        return float(score), ObjectId(id)
+    except (TypeError, ValueError, InvalidId, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def rank(query):
+    """(score, post id) pairs for ``query``, best first, scored with BM25
+    over the stored postings of its terms."""
+    terms = list(set(tokenize(query)))
+    if not terms:
+        return []
+    stats = SearchStats._get_collection().find_one({'_id': 'posts'}) or {}
+    n = max(stats.get('docs', 0), 1)
+    avgdl = float(stats.get('length', 0)) / n or 1.0
+    scores = {}
+    docs = SearchTerm._get_collection().find({'_id': {'$in': terms}})
+    # a fixed summation order keeps scores, and so cursors, reproducible
+    for doc in sorted(docs, key = lambda d: d['_id']):
+        df = max(doc['df'], len(doc['postings']))
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for p in doc['postings']:
+            tf = p['tf']
+            norm = tf + K1 * (1 - B + B * p['len'] / avgdl)
+            scores[p['post']] = scores.get(p['post'], 0.0) + \
+                idf * tf * (K1 + 1) / norm
+    return sorted(((score, post_id) for post_id, score in scores.items()),
+                  reverse = True)
+
+
+class SearchPagination(object):
+    """Cursor pagination over a ranked result list, with the interface of
+    CursorPagination; the cursors carry (score, id) of the edge items."""
+
+    def __init__(self, query, per_page, before = None, after = None):
+        from .models import Post
+        self.per_page = per_page
+        self.total = None
+        ranked = rank(query)
+        if after is not None:
+            edge = _decode(after)
+            earlier = [r for r in ranked if r > edge]
+            page = earlier[-per_page:]
+            self.has_prev, self.has_next = len(earlier) > per_page, True
+        else:
+            if before is not None:
+                edge = _decode(before)
+                ranked = [r for r in ranked if r < edge]
+            page = ranked[:per_page]
+            self.has_prev = before is not None
+            self.has_next = len(ranked) > per_page
+        self.ranks = page
+        posts = Post.objects.in_bulk([post_id for _, post_id in page])
+        self.items = [posts[post_id] for _, post_id in page if post_id in posts]
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.ranks:
+            return _encode(*self.ranks[-1])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.ranks:
+            return _encode(*self.ranks[0])
+
+
+def search_posts(query, per_page):
+    """Build a SearchPagination from the ``before``/``after`` request args."""
+    try:
+        return SearchPagination(query, per_page,
+                                before = request.args.get('before'),
+                                after = request.args.get('after'))
+    except InvalidCursor:
+        abort(400)
@@ -0,0 +1,197 @@
+from flask import abort, current_app, request
+from mongoengine.queryset.visitor import Q
+from pymongo import UpdateOne
+from . import db
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+class Timeline(db.Document):
+    # One document per reader, keyed by the reader's id, holding the newest
+    # FLASKY_TIMELINE_LENGTH entries pushed by the authors they follow,
+    # newest first by (timestamp, post).
+    owner = db.ObjectIdField(primary_key = True)
+    entries = db.ListField(db.DictField())
+    meta = {'collection': 'timelines', 'index_background': True}
+
+
+def _entry(post):
+    return {'post': post.id,
+            'author': post.author.id,
+            'timestamp': post.timestamp}
+
+
+def _push(owner_ids, entries):
+    length = current_app.config['FLASKY_TIMELINE_LENGTH']
+    batch = current_app.config['FLASKY_TIMELINE_BATCH']
+    update = {'$push': {'entries': {'$each': entries,
+                                    '$sort': {'timestamp': -1, 'post': -1},
+                                    '$slice': length}}}
+    requests = [UpdateOne({'_id': owner_id}, update, upsert = True)
+                for owner_id in owner_ids]
+    collection = Timeline._get_collection()
+    for i in range(0, len(requests), batch):
+        collection.bulk_write(requests[i:i + batch], ordered = False)
+
+
+def follower_ids(user):
+    from .models import Follow
+    return Follow.objects(followed = user.id).scalar('follower')
+
+
+def is_celebrity(user):
+    limit = current_app.config['FLASKY_TIMELINE_FANOUT_LIMIT']
+    return (user.followers_count or 0) > limit
+
+
+def celebrity_ids(user):
+    """Followed users whose posts are merged at read time."""
+    from .models import Follow
+    return Follow.objects(celebrity = True, follower = user.id).scalar('followed')
+
+
+def fan_out(post):
+    """Push a new post onto the timelines of the author's followers."""
+    author = post.author
+    owners = [author.id]
+    if not is_celebrity(author):
+        owners.extend(follower_ids(author))
+    _push(owners, [_entry(post)])
+
+
+def followed_ids(user):
+    from .models import Follow
+    return Follow.objects(follower = user.id).scalar('followed')
+
+
+def _recent_entries(author):
+    from .models import Post
+    posts = Post.objects(author = author.id).order_by('-timestamp', '-id') \
+        .only('id', 'author', 'timestamp').no_dereference() \
+        .limit(current_app.config['FLASKY_TIMELINE_LENGTH'])
+    return [{'post': p.id, 'author': p.author.id, 'timestamp': p.timestamp}
+            for p in posts]
+
+
+def on_follow(user, author):
+    """Merge a newly followed author's recent posts into a timeline, or
+    switch the author to read-time merging once this follow takes them
+    past FLASKY_TIMELINE_FANOUT_LIMIT."""
+    from .models import Follow
+    limit = current_app.config['FLASKY_TIMELINE_FANOUT_LIMIT']
+    if (author.followers_count or 0) + 1 > limit:
+        Follow.objects(followed = author.id).update(set__celebrity = True)
+        return
+    entries = _recent_entries(author)
+    if entries:
+        _push([user.id], entries)
+
+
+def on_unfollow(user, author):
+    """Drop an author from a timeline and, once the unfollow takes them back
+    to FLASKY_TIMELINE_FANOUT_LIMIT followers, switch them back to fan-out:
+    clear the celebrity flag on their edges and push their recent posts to
+    the followers that were merging them at read time."""
+    from .models import Follow, User
+    Timeline._get_collection().update_one(
+        {'_id': user.id}, {'$pull': {'entries': {'author': author.id}}})
+    count = User.objects(id = author.id).scalar('followers_count').first()
+    if (count or 0) > current_app.config['FLASKY_TIMELINE_FANOUT_LIMIT']:
+        return
+    if not Follow.objects(followed = author.id, celebrity = True) \
+            .update(unset__celebrity = True):
+        return
+    entries = _recent_entries(author)
+    if entries:
+        _push(list(follower_ids(author)), entries)
+
+
+class TimelinePagination(object):
+    """Cursor pagination over a reader's followed feed, with the interface
+    of CursorPagination and the same cursors.
+
+    A page is cut from the stored (timestamp, post) entries and merged with
+    the same range of posts by followed celebrities, so it costs one
+    timeline read, one indexed range read when there are celebrities, and
+    an _id lookup for the posts on the page.
+    """
+
+    def __init__(self, user, per_page, before = None, after = None):
+        from .models import Post
+        self.per_page = per_page
+        self.total = None
+        edge = decode_cursor(after if after is not None else before) \
+            if after is not None or before is not None else None
+        timeline = Timeline._get_collection().find_one(
+            {'_id': user.id}, {'entries.timestamp': 1, 'entries.post': 1}) or {}
+        ranked = set((e['timestamp'], e['post'])
+                     for e in timeline.get('entries', ()))
+        celebrities = list(celebrity_ids(user))
+        if celebrities:
+            ranked.update(self._celebrity_posts(celebrities, per_page,
+                                                edge, after is not None))
+        ranked = sorted(ranked, reverse = True)
+        if after is not None:
+            earlier = [r for r in ranked if r > edge]
+            page = earlier[-per_page:]
+            self.has_prev, self.has_next = len(earlier) > per_page, True
+        else:
+            if before is not None:
+                ranked = [r for r in ranked if r < edge]
+            page = ranked[:per_page]
+            self.has_prev = before is not None
+            self.has_next = len(ranked) > per_page
+        self.ranks = page
+        posts = Post.objects.in_bulk([post_id for _, post_id in page])
+        self.items = [posts[post_id] for _, post_id in page if post_id in posts]
+
+    @staticmethod
+    def _celebrity_posts(authors, per_page, edge, after):
+        # the per_page + 1 posts nearest the edge are all a page can use
+        from .models import Post
+        query = Post.objects(author__in = authors)
+        if edge is None:
+            query = query.order_by('-timestamp', '-id')
+        elif after:
+            query = query.filter(
+                Q(timestamp__gt = edge[0]) | Q(timestamp = edge[0], id__gt = edge[1])
+            ).order_by('timestamp', 'id')
+        else:
+            query = query.filter(
+                Q(timestamp__lt = edge[0]) | Q(timestamp = edge[0], id__lt = edge[1])
+            ).order_by('-timestamp', '-id')
+        return [(p['timestamp'], p['_id']) for p in
+                query.limit(per_page + 1).as_pymongo().only('id', 'timestamp')]
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.ranks:
+            return encode_cursor(*self.ranks[-1])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.ranks:
+            return encode_cursor(*self.ranks[0])
+
+
+def timeline_page(user, per_page):
+    """Build a TimelinePagination from the ``before``/``after`` request args."""
+    try:
+        return TimelinePagination(user, per_page,
+                                  before = request.args.get('before'),
+                                  after = request.args.get('after'))
+    except InvalidCursor:
+        abort(400)
+
+
+def rebuild(user):
+    """Recompute a reader's timeline with a query-time scan."""
+    from .models import Post
+    celebrities = set(celebrity_ids(user))
+    authors = [user.id] + [a for a in followed_ids(user) if a not in celebrities]
+    length = current_app.config['FLASKY_TIMELINE_LENGTH']
+    posts = Post.objects(author__in = authors).order_by('-timestamp', '-id') \
+        .only('id', 'author', 'timestamp').no_dereference().limit(length)
+    entries = [{'post': p.id, 'author': p.author.id, 'timestamp': p.timestamp}
+               for p in posts]
+    Timeline._get_collection().replace_one(
+        {'_id': user.id}, {'_id': user.id, 'entries': entries}, upsert = True)
@@ -0,0 +1,126 @@
+"""Throughput of the asyncio serving path against the Flask app.
+
+    BENCH_MONGODB_HOST=mongodb://localhost python -m benchmarks.aio 4 64
+
+Seeds the BENCH_MONGODB_HOST database (the users, follows, posts,
+timelines and search collections there are dropped), then serves it with
+the given number of workers, first with gunicorn running the Flask app and
+then with uvicorn running app.aio, and drives both with the given number
+of concurrent clients requesting random index, profile and post pages.
+The response cache is off so every request reaches MongoDB.
+
+Needs gunicorn, the packages in requirements/async.txt and a real MongoDB
+server.
+"""
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+from app import create_app
+from app.fake import populate
+from app.indexes import DOCUMENTS
+from app.models import Role, User, Post
+
+PORT = 8765
+DURATION = 20
+USERS = 1000
+POSTS = 20000
+FOLLOWS = 20000
+
+
+def seed():
+    for document in DOCUMENTS:
+        if document is not Role:
+            document.drop_collection()
+    populate(USERS, POSTS, FOLLOWS)
+    usernames = list(User.objects.scalar('username'))
+    indexes = list(Post.objects.order_by('-timestamp').limit(1000).scalar('idx'))
+    return ['/'] + ['/user/%s' % u for u in usernames] + \
+        ['/post/%s' % i for i in indexes]
+
+
+def serve(command, workers):
+    env = dict(os.environ, FLASK_CONFIG='benchmark', BENCH_RESPONSE_CACHE='0')
+    args = {
+        'sync': ['gunicorn', '-w', str(workers), '-b', '127.0.0.1:%d' % PORT,
+                 "app:create_app('benchmark')"],
+        'async': ['uvicorn', '--factory', 'app.aio:create_asgi_app',
+                  '--workers', str(workers), '--port', str(PORT),
+                  '--log-level', 'warning'],
+    }[command]
+    server = subprocess.Popen(args, env=env)
+    for _ in range(100):
+        try:
+            connection = HTTPConnection('127.0.0.1', PORT)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return server
+        except (IOError, OSError):
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('%s server did not start' % command)
+
+
+def drive(paths, clients):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + DURATION
+
+    def client(seed):
+        rng = random.Random(seed)
+        connection = HTTPConnection('127.0.0.1', PORT)
+        timings = []
+        failed = 0
+        while time.time() < deadline:
+            start = time.time()
+            connection.request('GET', rng.choice(paths))
+            response = connection.getresponse()
+            response.read()
+            timings.append(time.time() - start)
+            if response.status != 200:
+                failed += 1
+        with lock:
+            latencies.extend(timings)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {'rps': len(latencies) / float(DURATION),
+            'p50': latencies[len(latencies) // 2] * 1000,
+            'p95': latencies[int(len(latencies) * 0.95)] * 1000,
+            'errors': errors[0]}
+
+
+def run(workers, clients):
+    app = create_app('benchmark')
+    if app.config['MONGODB_HOST'].startswith('mongomock://'):
+        sys.exit('set BENCH_MONGODB_HOST to a real MongoDB server')
+    with app.app_context():
+        paths = seed()
+    print('%-6s %8s %10s %10s %8s' % ('mode', 'req/s', 'p50 ms', 'p95 ms',
+                                      'errors'))
+    for mode in ('sync', 'async'):
+        server = serve(mode, workers)
+        try:
+            result = drive(paths, clients)
+        finally:
+            server.terminate()
+            server.wait()
+        print('%-6s %8.1f %10.2f %10.2f %8d' % (
+            mode, result['rps'], result['p50'], result['p95'], result['errors']))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 64)
@@ -0,0 +1,151 @@
+"""Latency and query counts for the blog's hot endpoints.
+
+Seeds the 'benchmark' database (mongomock unless BENCH_MONGODB_HOST points
+at a real mongod) and drives the app through the Flask test client, so
+every request gets its own request and app context. Query counts come
+from pymongo command monitoring, which mongomock bypasses: against it
+they are reported as n/a.
+"""
+import json
+import subprocess
+import sys
+import time
+from random import Random
+import mongoengine
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def seed(users, posts, follows, rng):
+    from app.fake import populate
+    from app.models import Role, User, Post, Follow
+    from app.timeline import Timeline
+    for document in (Role, User, Post, Follow, Timeline):
+        document.drop_collection()
+    Role.insert_roles()
+    populate(users, posts, follows, seed=rng.randint(0, 2 ** 32))
+    everyone = list(User.objects.only('id', 'username', 'followers_count'))
+    reader = User(email='bench@example.com', username='bench', confirmed=True)
+    reader.password = 'bench'
+    reader.save()
+    for author in rng.sample(everyone, min(len(everyone), 50)):
+        reader.follow(author)
+    return reader
+
+
+def scenarios(app, client, rng):
+    from app.models import User, Post
+    with app.app_context():
+        usernames = list(User.objects.scalar('username'))
+        idxs = list(Post.objects.scalar('idx'))
+    # URLs are built without a request context, which would otherwise stay
+    # pushed under every request the client makes
+    url_for = app.url_map.bind('localhost').build
+
+    def login():
+        return client.post(url_for('auth.login'),
+                           data={'email': 'bench@example.com', 'password': 'bench'})
+
+    def logout():
+        client.get(url_for('auth.logout'))
+
+    return [
+        ('index', 'main.index', None, lambda: client.get(url_for('main.index'))),
+        ('user', 'main.user', None, lambda: client.get(
+            url_for('main.user', {'username': rng.choice(usernames)}))),
+        ('post', 'main.post', None, lambda: client.get(
+            url_for('main.post', {'idx': rng.choice(idxs)}))),
+        ('followers', 'main.followers', None, lambda: client.get(
+            url_for('main.followers', {'username': rng.choice(usernames)}))),
+        ('login', 'auth.login', logout, login),
+        ('index (signed in)', 'main.index', login,
+         lambda: client.get(url_for('main.index'))),
+        ('create post', 'main.index', login, lambda: client.post(
+            url_for('main.index'),
+            data={'body': 'benchmark post %d' % rng.randint(0, 10 ** 9)})),
+    ]
+
+
+def counts_queries(app):
+    return not app.config['MONGODB_HOST'].startswith('mongomock://')
+
+
+def run(app, users=100, posts=1000, follows=500, requests=200, seed_value=0):
+    from app import profiler
+    rng = Random(seed_value)
+    results = {}
+    with app.app_context():
+        seed(users, posts, follows, rng)
+    client = app.test_client()
+    for name, endpoint, setup, send in scenarios(app, client, rng):
+        if setup is not None:
+            setup()
+        profiler.endpoints.clear()
+        latencies = []
+        for _ in range(requests):
+            if name == 'login':
+                setup()
+            start = time.time()
+            response = send()
+            latencies.append((time.time() - start) * 1000)
+            assert response.status_code < 400, (name, response.status_code)
+        stats = profiler.stats()['endpoints'].get(endpoint, {})
+        results[name] = {
+            'requests': requests,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'throughput': requests / (sum(latencies) / 1000.0),
+            'queries_per_request': stats.get('mean_db_queries', 0.0)
+                                   if counts_queries(app) else None,
+        }
+    return results
+
+
+def report(results, baseline=None):
+    print('%-20s %9s %9s %9s %10s %8s' % ('endpoint', 'p50 ms', 'p95 ms',
+                                           'p99 ms', 'req/s', 'queries'))
+    for name, r in sorted(results.items()):
+        queries = r['queries_per_request']
+        line = '%-20s %9.2f %9.2f %9.2f %10.1f %8s' % (
+            name, r['p50'], r['p95'], r['p99'], r['throughput'],
+            'n/a' if queries is None else '%.1f' % queries)
+        if baseline and name in baseline.get('results', {}):
+            before = baseline['results'][name]['p95']
+            if before:
+                line += '  p95 %+.0f%%' % ((r['p95'] - before) / before * 100)
+        print(line)
+
+
+def save(path, results, scale):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip().decode()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with open(path, 'w') as f:
+        json.dump({'commit': commit, 'time': time.time(), 'scale': scale,
+                   'results': results}, f, indent=2, sort_keys=True)
+
+
+def main(users, posts, follows, requests, output=None, compare=None):
+    from app import create_app
+    # manage.py has already connected the default alias for its own app
+    mongoengine.disconnect()
+    app = create_app('benchmark')
+    if not counts_queries(app):
+        sys.stderr.write('warning: mongomock does not report queries; set '
+                         'BENCH_MONGODB_HOST to a real server to count them\n')
+    results = run(app, users, posts, follows, requests)
+    baseline = None
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if output:
+        save(output, results, {'users': users, 'posts': posts,
+                               'follows': follows, 'requests': requests})
@@ -0,0 +1,56 @@
+"""Password checks per second through the hashing pool.
+
+    python -m benchmarks.hashing [threads] [checks]
+
+Runs ``checks`` (default 200) password verifications from ``threads``
+(default 16) request threads, the way a burst of logins would, once inline
+and once for each pool size, and reports throughput and p95 latency.
+"""
+import sys
+import threading
+import time
+from app import create_app
+from app.hashing import PasswordHasher
+from .endpoints import percentile
+
+POOL_SIZES = [0, 1, 2, 4, 8]
+
+
+def measure(hasher, password_hash, threads, checks):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = max(1, checks // threads)
+
+    def login():
+        for _ in range(per_thread):
+            start = time.time()
+            assert hasher.verify(password_hash, 'secret')
+            with lock:
+                latencies.append((time.time() - start) * 1000)
+
+    workers = [threading.Thread(target=login) for _ in range(threads)]
+    start = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return len(latencies) / (time.time() - start), percentile(latencies, 95)
+
+
+def run(threads, checks):
+    app = create_app('testing')
+    print('method: %s' % app.config['FLASKY_PASSWORD_HASH_METHOD'])
+    print('%8s %12s %10s' % ('workers', 'logins/s', 'p95 ms'))
+    for size in POOL_SIZES:
+        app.config.update(FLASKY_PASSWORD_HASH_WORKERS=size,
+                          FLASKY_PASSWORD_HASH_QUEUE=threads)
+        hasher = PasswordHasher(app)
+        password_hash = hasher.hash('secret')
+        throughput, p95 = measure(hasher, password_hash, threads, checks)
+        hasher.shutdown()
+        print('%8s %12.1f %10.1f' % (size or 'inline', throughput, p95))
+
+
+if __name__ == '__main__':
+    args = [int(n) for n in sys.argv[1:]]
+    run(*(args + [16, 200][len(args):]))
@@ -0,0 +1,49 @@
+"""Throughput of the mail dispatcher against a local fake SMTP server.
+
+    python -m benchmarks.mail [count]
+
+Queues ``count`` (default 10000) confirmation mails and reports how long
+the dispatcher takes to deliver them and how many SMTP connections it
+opened doing so.
+"""
+import sys
+import time
+from app import create_app, mail, mail_dispatcher
+from app.email import send_email
+from .smtp import FakeSMTPServer
+
+
+class FakeUser(object):
+    def __init__(self, i):
+        self.username = 'user%d' % i
+        self.email = 'user%d@example.com' % i
+
+
+def run(count):
+    server = FakeSMTPServer().start()
+    app = create_app('testing')
+    app.config.update(MAIL_SERVER='127.0.0.1',
+                      MAIL_PORT=server.port, MAIL_USE_SSL=False,
+                      MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False,
+                      MAIL_USERNAME=None,
+                      FLASKY_MAIL_QUEUE_SIZE=count)
+    mail.init_app(app)
+    mail_dispatcher.init_app(app)
+    start = time.time()
+    with app.test_request_context():
+        for i in range(count):
+            user = FakeUser(i)
+            send_email(user.email, 'Confirm Your Account',
+                       'auth/email/confirm', user=user, token='token%d' % i)
+    queued = time.time() - start
+    mail_dispatcher.queue.join()
+    elapsed = time.time() - start
+    server.stop()
+    print('queued %d messages in %.2fs' % (count, queued))
+    print('delivered %d messages in %.2fs (%.0f/s) over %d connections' % (
+        server.counts['messages'], elapsed, server.counts['messages'] / elapsed,
+        server.counts['connections']))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
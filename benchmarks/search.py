@@ -0,0 +1,45 @@
+"""Search latency as the number of posts grows.
+
+    python -m benchmarks.search 1000 10000 100000
+
+Seeds the database configured for the 'testing' config at each size (the
+users, follows, posts, timelines and search collections there are dropped),
+rebuilds the search index and times the first results page for a few
+queries.
+"""
+import sys
+import time
+from app import create_app
+from app.fake import populate
+from app.indexes import DOCUMENTS
+from app.models import Role
+from app.search import rebuild_index, SearchPagination
+
+REPEAT = 20
+QUERIES = ['lorem', 'dolor sit amet', 'consectetur adipiscing', 'nonexistent']
+
+
+def measure(query, per_page=20):
+    SearchPagination(query, per_page)
+    start = time.time()
+    for _ in range(REPEAT):
+        SearchPagination(query, per_page)
+    return (time.time() - start) / REPEAT * 1000
+
+
+def run(counts):
+    print('%10s %-24s %10s' % ('posts', 'query', 'ms'))
+    for count in counts:
+        for document in DOCUMENTS:
+            if document is not Role:
+                document.drop_collection()
+        populate(max(count // 100, 10), count, 0)
+        rebuild_index()
+        for query in QUERIES:
+            print('%10d %-24s %10.2f' % (count, query, measure(query)))
+
+
+if __name__ == '__main__':
+    app = create_app('testing')
+    with app.app_context():
+        run([int(n) for n in sys.argv[1:]] or [1000, 10000, 100000])
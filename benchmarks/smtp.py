@@ -0,0 +1,90 @@
+"""A minimal local SMTP sink for exercising the mail dispatcher."""
+import threading
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        self.server.record('connections')
+        self.reply(b'220 localhost fake SMTP')
+        in_data = False
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if in_data:
+                if line.rstrip(b'\r\n') == b'.':
+                    in_data = False
+                    self.server.record('messages', recipients)
+                    recipients = []
+                    self.reply(b'250 OK')
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.reply(b'250 localhost')
+            elif command == b'RCPT':
+                address = line.split(b':', 1)[1].strip(b' <>\r\n').decode('ascii')
+                if address in self.server.hang_up:
+                    return
+                if address in self.server.reject:
+                    self.reply(b'550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply(b'250 OK')
+            elif command == b'RSET':
+                recipients = []
+                self.reply(b'250 OK')
+            elif command == b'DATA':
+                in_data = True
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self.reply(b'221 Bye')
+                return
+            else:
+                self.reply(b'250 OK')
+
+
+class FakeSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Counts connections and messages and records who was delivered to.
+
+    Recipients in ``reject`` are refused with a 550; naming one in
+    ``hang_up`` makes the server drop the connection.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, reject=(), hang_up=()):
+        socketserver.TCPServer.__init__(self, (host, port), _Handler)
+        self.reject = frozenset(reject)
+        self.hang_up = frozenset(hang_up)
+        self.counts = {'connections': 0, 'messages': 0}
+        self.delivered = []
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def record(self, name, recipients=()):
+        with self._lock:
+            self.counts[name] += 1
+            self.delivered.extend(recipients)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
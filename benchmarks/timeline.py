@@ -0,0 +1,82 @@
+"""Compare the followed feed read from the materialized timeline with the
+query-time "posts by anyone I follow" scan.
+
+    python -m benchmarks.timeline 10 1000 100000
+
+Runs against the database configured for the 'testing' config and drops the
+users, posts and timelines collections there.
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from random import Random
+from bson import ObjectId
+from app import create_app
+from app.models import User, Post, Follow
+from app.timeline import Timeline, TimelinePagination, rebuild
+
+REPEAT = 50
+
+
+def seed(followed_count, rng):
+    for doc in (User, Post, Follow, Timeline):
+        doc.drop_collection()
+    reader_id = ObjectId()
+    author_ids = [ObjectId() for _ in range(followed_count)]
+    users = [{'_id': reader_id, 'username': 'reader', 'email': 'reader@example.com',
+              'followed_count': followed_count}]
+    users.extend({'_id': a, 'username': 'author%d' % i,
+                  'email': 'author%d@example.com' % i,
+                  'followers_count': 1}
+                 for i, a in enumerate(author_ids))
+    follows = [{'follower': reader_id, 'followed': a} for a in author_ids]
+    now = datetime.utcnow()
+    posts = []
+    for a in author_ids:
+        oid = ObjectId()
+        posts.append({'_id': oid, 'idx': str(oid), 'author': a,
+                      'body': 'post by %s' % a,
+                      'timestamp': now - timedelta(minutes=rng.randint(0, 10 ** 6))})
+    for i in range(0, len(users), 10000):
+        User._get_collection().insert_many(users[i:i + 10000])
+    for i in range(0, len(posts), 10000):
+        Post._get_collection().insert_many(posts[i:i + 10000])
+    for i in range(0, len(follows), 10000):
+        Follow._get_collection().insert_many(follows[i:i + 10000])
+    for doc in (Post, Follow):
+        doc.ensure_indexes()
+    reader = User.objects(id=reader_id).first()
+    rebuild(reader)
+    return reader
+
+
+def measure(fn):
+    fn()
+    start = time.time()
+    for _ in range(REPEAT):
+        fn()
+    return (time.time() - start) / REPEAT * 1000
+
+
+def run(counts, per_page=20):
+    rng = Random(0)
+    print('%10s %14s %14s' % ('followed', 'query (ms)', 'timeline (ms)'))
+    for count in counts:
+        reader = seed(count, rng)
+        followed = list(Follow.objects(follower=reader.id).scalar('followed'))
+
+        def query_time():
+            return list(Post.objects(author__in=followed)
+                        .order_by('-timestamp').limit(per_page))
+
+        def materialized():
+            return TimelinePagination(reader, per_page).items
+
+        print('%10d %14.2f %14.2f' % (count, measure(query_time),
+                                      measure(materialized)))
+
+
+if __name__ == '__main__':
+    app = create_app('testing')
+    with app.app_context():
+        run([int(n) for n in sys.argv[1:]] or [10, 1000, 100000])
@@ -4,7 +4,17 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard to guess string'
-    MONGODB_DB = 'mydb'
+    MONGODB_DB = os.environ.get('MONGODB_DB') or 'mydb'
+    # a host name or a mongodb:// URI, e.g. listing a replica set's members
+    MONGODB_HOST = os.environ.get('MONGODB_HOST') or 'localhost'
+    MONGODB_POOL_SIZE = int(os.environ.get('MONGODB_POOL_SIZE') or 100)
+    MONGODB_CONNECT_TIMEOUT_MS = 5000
+    MONGODB_SOCKET_TIMEOUT_MS = 30000
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = 5000
+    MONGODB_WRITE_CONCERN = 1
+    # None keeps every read on the primary
+    MONGODB_SECONDARY_READ_PREFERENCE = None
+    MONGODB_SECONDARY_MAX_STALENESS = 90
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     MAIL_SERVER = 'smtp.qq.com'
     MAIL_PORT = 465
@@ -14,9 +24,45 @@ class Config:
     MAIL_PASSWORD = 'qxjydbgdswabbgjf'
     FLASKY_MAIL_SUBJECT_PREFIX = '[Flasky]'
     FLASKY_MAIL_SENDER = 'Flasky Admin <flasky@example.com>'
+    FLASKY_MAIL_QUEUE_SIZE = 10000
+    FLASKY_MAIL_WORKERS = 4
+    FLASKY_MAIL_BATCH = 50
+    FLASKY_MAIL_RETRIES = 3
+    FLASKY_MAIL_RETRY_DELAY = 1.0
+    FLASKY_MAIL_ENQUEUE_TIMEOUT = 5
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
     FLASKY_POSTS_PER_PAGE = 20
     FLASKY_FOLLOWERS_PER_PAGE = 5
+    FLASKY_TIMELINE_LENGTH = 800
+    FLASKY_TIMELINE_FANOUT_LIMIT = 10000
+    FLASKY_TIMELINE_BATCH = 1000
+    FLASKY_COUNT_CACHE_TTL = 60
+    FLASKY_SYNC_INDEXES = False
+    FLASKY_CACHE_BACKEND = None
+    FLASKY_USER_CACHE_SIZE = 10000
+    FLASKY_USER_CACHE_TTL = 300
+    FLASKY_RESPONSE_CACHE = True
+    FLASKY_RESPONSE_CACHE_SIZE = 5000
+    FLASKY_RESPONSE_CACHE_TTL = 300
+    FLASKY_HTTP_MAX_AGE = 60
+    FLASKY_PROFILE = os.environ.get('FLASKY_PROFILE') == '1'
+    FLASKY_LAST_SEEN_INTERVAL = 60
+    FLASKY_LAST_SEEN_FLUSH = 10
+    FLASKY_LAST_SEEN_WRITE_CONCERN = 0
+    FLASKY_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    FLASKY_PASSWORD_HASH_WORKERS = 2
+    FLASKY_PASSWORD_HASH_QUEUE = 64
+    FLASKY_PASSWORD_HASH_TIMEOUT = 2
+    FLASKY_PASSWORD_HASH_RESULT_TIMEOUT = 10
+    FLASKY_SEARCH_POSTINGS = 1000
+    FLASKY_API_PER_PAGE = 50
+    FLASKY_API_MAX_PER_PAGE = 200
+    FLASKY_API_EXPORT_BATCH = 1000
+    FLASKY_FEED_SIZE = 20
+    FLASKY_SECONDARY_READ_VIEWS = ['main.index', 'main.user', 'main.post',
+                                   'main.followers', 'main.followed_by']
+    FLASKY_READ_YOUR_WRITES = 30
+    FLASKY_SECONDARY_CACHE_TTL = 10
 
     @staticmethod
     def init_app(app):
@@ -25,16 +71,32 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    FLASKY_RESPONSE_CACHE = False
 
 
 
 class TestingConfig(Config):
     TESTING = True
+    FLASKY_PASSWORD_HASH_WORKERS = 0
+    MONGODB_DB = os.environ.get('TEST_MONGODB_DB') or 'mydb-test'
+    MONGODB_HOST = os.environ.get('TEST_MONGODB_HOST') or 'mongomock://localhost'
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
 
 
+class BenchmarkConfig(Config):
+    MONGODB_HOST = os.environ.get('BENCH_MONGODB_HOST') or 'mongomock://localhost'
+    MONGODB_DB = os.environ.get('BENCH_MONGODB_DB') or 'mydb-bench'
+    WTF_CSRF_ENABLED = False
+    FLASKY_PROFILE = True
+    # benchmarks/aio.py turns the response cache off to measure the reads
+    FLASKY_RESPONSE_CACHE = os.environ.get('BENCH_RESPONSE_CACHE', '1') == '1'
+
+
 class ProductionConfig(Config):
+    FLASKY_SYNC_INDEXES = True
+    MONGODB_SECONDARY_READ_PREFERENCE = \
+        os.environ.get('MONGODB_SECONDARY_READ_PREFERENCE') or 'secondaryPreferred'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
 
@@ -43,6 +105,7 @@ config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
     'production': ProductionConfig,
+    'benchmark': BenchmarkConfig,
 
     'default': DevelopmentConfig
 }
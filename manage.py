@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 import os
 from app import create_app, db
-from app.models import User
+from app.models import User, Role, Post
 from flask_script import Manager, Shell
 from flask_migrate import Migrate, MigrateCommand
 
@@ -11,7 +11,7 @@ manager = Manager(app)
 
 
 def make_shell_context():
-    return dict(app=app, db=db, User=User, Role=Role)
+    return dict(app=app, db=db, User=User, Role=Role, Post=Post)
 manager.add_command("shell", Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
 
@@ -24,5 +24,113 @@ def test():
     unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@manager.command
+def deploy():
+    """Run deployment tasks."""
+    from app.indexes import sync_indexes
+    Role.insert_roles()
+    User.migrate_follow_lists()
+    sync_indexes()
+
+
+@manager.command
+def backfill_idx():
+    """Set the permalink id on posts created before it was stored."""
+    count = Post.backfill_idx()
+    print('Backfilled %d posts.' % count)
+
+
+@manager.command
+def indexes():
+    """Build the MongoDB indexes and report queries that miss them."""
+    import json
+    from app.indexes import sync_indexes, audit_queries
+    for collection, names in sorted(sync_indexes().items()):
+        print('%s: %s' % (collection, ', '.join(names)))
+    scans = audit_queries()
+    for name, explain in scans:
+        print('Collection scan in %s:' % name)
+        print(json.dumps(explain, indent=2, default=str))
+    if not scans:
+        print('Every query shape uses an index.')
+
+
+@manager.command
+def render_posts():
+    """Re-render post bodies produced by an older renderer or whitelist."""
+    count = Post.rerender_stale()
+    print('Re-rendered %d posts.' % count)
+
+
+@manager.command
+def migrate_follows():
+    """Convert the old followers/followed lists into Follow edges."""
+    count = User.migrate_follow_lists()
+    print('Migrated %d follow edges.' % count)
+
+
+@manager.command
+def backfill_avatars():
+    """Store the gravatar hash on users created before it was saved."""
+    count = User.backfill_avatar_hashes()
+    print('Backfilled %d users.' % count)
+
+
+@manager.command
+def reindex():
+    """Rebuild the post search index from scratch."""
+    from app.search import rebuild_index
+    count = rebuild_index()
+    print('Indexed %d posts.' % count)
+
+
+@manager.option('-u', '--users', type=int, default=1000, help='Users to create')
+@manager.option('-p', '--posts', type=int, default=10000, help='Posts to create')
+@manager.option('-f', '--follows', type=int, default=20000,
+                help='Follow edges to create')
+@manager.option('-a', '--alpha', type=float, default=1.0,
+                help='Power-law exponent of follower counts, 0 for uniform')
+@manager.option('-s', '--seed', type=int, default=0, help='Random seed')
+@manager.option('--drop', action='store_true', default=False,
+                help='Drop the existing data first')
+def seed(users, posts, follows, alpha, seed, drop):
+    """Bulk-load a consistent fake dataset for development or load tests."""
+    from app.fake import populate
+    from app.indexes import DOCUMENTS, sync_indexes
+    from app.search import rebuild_index
+    if drop:
+        for document in DOCUMENTS:
+            if document is not Role:
+                document.drop_collection()
+    counts = populate(users, posts, follows, alpha, seed)
+    sync_indexes()
+    rebuild_index()
+    print('Created %(users)d users, %(follows)d follows, %(posts)d posts '
+          'and %(timelines)d timelines.' % counts)
+
+
+@manager.option('-u', '--users', type=int, default=100, help='Users to seed')
+@manager.option('-p', '--posts', type=int, default=1000, help='Posts to seed')
+@manager.option('-f', '--follows', type=int, default=500, help='Follows to seed')
+@manager.option('-n', '--requests', type=int, default=200,
+                help='Requests per endpoint')
+@manager.option('-o', '--output', default=None, help='Save results as JSON')
+@manager.option('-c', '--compare', default=None,
+                help='Earlier JSON results to compare against')
+def bench(users, posts, follows, requests, output, compare):
+    """Benchmark the hot endpoints against a seeded database."""
+    from benchmarks.endpoints import main
+    main(users, posts, follows, requests, output, compare)
+
+
+@manager.option('-w', '--workers', type=int, default=1, help='Worker processes')
+@manager.option('-p', '--port', type=int, default=8000, help='Port to listen on')
+def serve_async(workers, port):
+    """Serve the app with the asyncio path for anonymous page reads."""
+    import uvicorn
+    uvicorn.run('app.aio:create_asgi_app', factory=True, port=port,
+                workers=workers)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,47 @@
+import json
+import unittest
+from app import create_app
+from app.indexes import DOCUMENTS
+from app.models import Role, User
+
+
+class FollowListingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_RESPONSE_CACHE'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.john = self.add_user('john')
+        self.susan = self.add_user('susan')
+        self.susan.follow(self.john)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def add_user(self, username):
+        user = User(email='%s@example.com' % username, username=username)
+        user.password = 'cat'
+        user.save()
+        return user
+
+    def get_users(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.get_data(as_text=True))['users']
+
+    def test_followers(self):
+        users = self.get_users('/api/v1/users/john/followers/')
+        self.assertEqual([(u['id'], u['username']) for u in users],
+                         [(str(self.susan.id), 'susan')])
+        self.assertTrue(users[0]['url'].endswith('/api/v1/users/susan'))
+        self.assertIsNotNone(users[0]['timestamp'])
+
+    def test_followed(self):
+        users = self.get_users('/api/v1/users/susan/followed/')
+        self.assertEqual([(u['id'], u['username']) for u in users],
+                         [(str(self.john.id), 'john')])
+        self.assertIsNotNone(users[0]['timestamp'])
@@ -0,0 +1,80 @@
+import time
+import unittest
+from app import create_app
+from app.cache import LRUCache, DictStore, TieredCache, DocumentCache
+from app.indexes import DOCUMENTS
+from app.models import Role, User
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_expiry(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_tiered_delete(self):
+        shared = DictStore()
+        cache = TieredCache(LRUCache(), shared)
+        cache.set('a', {'x': 1})
+        cache.delete('a')
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNone(shared.get('a'))
+
+
+class DocumentCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john')
+        self.user.password = 'cat'
+        self.user.save()
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def load(self, cache):
+        return cache.get(User, self.user.id,
+                         lambda: User.objects(id=self.user.id).first())
+
+    def confirm(self, confirmed):
+        User.objects(id=self.user.id).update_one(set__confirmed=confirmed)
+
+    def test_invalidate(self):
+        cache = DocumentCache('user', self.app)
+        self.assertTrue(self.load(cache).confirmed)
+        self.confirm(False)
+        self.assertTrue(self.load(cache).confirmed)
+        cache.invalidate(self.user.id)
+        self.assertFalse(self.load(cache).confirmed)
+
+    def test_invalidate_across_workers(self):
+        store = DictStore()
+        self.app.config['FLASKY_CACHE_BACKEND'] = lambda app: store
+        worker1 = DocumentCache('user', self.app)
+        worker2 = DocumentCache('user', self.app)
+        self.assertTrue(self.load(worker1).confirmed)
+        self.assertTrue(self.load(worker2).confirmed)
+        self.confirm(False)
+        worker1.invalidate(self.user.id)
+        self.assertFalse(self.load(worker2).confirmed)
+        self.assertEqual(worker2.stats()['misses'], 1)
+
+    def test_fresh_copies(self):
+        cache = DocumentCache('user', self.app)
+        self.load(cache).location = 'Mars'
+        self.assertIsNone(self.load(cache).location)
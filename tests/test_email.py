@@ -0,0 +1,99 @@
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from flask_mail import Message
+from app import create_app, mail, mail_dispatcher
+from app.email import send_email
+from app.indexes import DOCUMENTS
+from app.models import Role, User
+from benchmarks.smtp import FakeSMTPServer
+
+ADDRESSES = ['user%d@example.com' % i for i in range(5)]
+
+
+class MailDispatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config.update(FLASKY_MAIL_RETRIES=2, FLASKY_MAIL_RETRY_DELAY=0)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop()
+
+    def deliver(self, addresses=ADDRESSES, **kwargs):
+        self.server = FakeSMTPServer(**kwargs).start()
+        self.app.config.update(MAIL_SERVER='127.0.0.1',
+                               MAIL_PORT=self.server.port, MAIL_USE_SSL=False,
+                               MAIL_USE_TLS=False, MAIL_SUPPRESS_SEND=False,
+                               MAIL_USERNAME=None)
+        mail.init_app(self.app)
+        mail_dispatcher.init_app(self.app)
+        mail_dispatcher._deliver([
+            Message('Hello', sender='flasky@example.com', recipients=[to],
+                    body='Hello') for to in addresses])
+        return self.server
+
+    def test_delivers_batch_over_one_connection(self):
+        server = self.deliver()
+        self.assertEqual(server.delivered, ADDRESSES)
+        self.assertEqual(server.counts['connections'], 1)
+
+    def test_refused_recipient_is_skipped(self):
+        server = self.deliver(reject=[ADDRESSES[1]])
+        self.assertEqual(server.delivered, ADDRESSES[:1] + ADDRESSES[2:])
+        self.assertEqual(server.counts['connections'], 1)
+
+    def test_failing_message_is_dropped_alone(self):
+        server = self.deliver(hang_up=[ADDRESSES[2]])
+        self.assertEqual(server.delivered, ADDRESSES[:2] + ADDRESSES[3:])
+        # the first connection and one per retry of the failing message
+        self.assertEqual(server.counts['connections'], 4)
+
+    def test_unreachable_server(self):
+        server = FakeSMTPServer()
+        port = server.port
+        server.server_close()
+        self.app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port,
+                               MAIL_USE_SSL=False, MAIL_SUPPRESS_SEND=False)
+        mail.init_app(self.app)
+        mail_dispatcher.init_app(self.app)
+        with self.assertLogs(self.app.logger, 'ERROR') as logs:
+            mail_dispatcher._deliver([
+                Message('Hello', sender='flasky@example.com',
+                        recipients=[to], body='Hello') for to in ADDRESSES])
+        self.assertIn('Dropping 5 messages after 3 attempts', logs.output[0])
+
+
+class MailRendererTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john')
+        self.user.password = 'cat'
+        self.user.save()
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def test_confirmation_link(self):
+        token = self.user.generate_confirmation_token()
+        with mock.patch.object(mail_dispatcher, 'send') as send:
+            with self.app.test_request_context():
+                send_email(self.user.email, 'Confirm Your Account',
+                           'auth/email/confirm', user=self.user, token=token)
+        message = send.call_args[0][0].build()
+        if isinstance(token, bytes):
+            token = token.decode('utf-8')
+        link = 'http://localhost/auth/confirm/' + token
+        self.assertIn(link, message.body)
+        self.assertIn('href="%s"' % link, message.html)
+        self.assertIn('Dear john', message.body)
+        response = self.app.test_client().get(link)
+        self.assertNotEqual(response.status_code, 404)
@@ -0,0 +1,75 @@
+import unittest
+from app import create_app
+from app.indexes import DOCUMENTS
+from app.models import Role, User, Follow
+
+
+class FollowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.john, self.susan, self.david = \
+            [self.add_user(n) for n in ('john', 'susan', 'david')]
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def add_user(self, username):
+        user = User(email='%s@example.com' % username, username=username)
+        user.password = 'cat'
+        user.save()
+        return user
+
+    def counts(self, user):
+        user.reload()
+        return user.followers_count, user.followed_count
+
+    def test_follow_and_unfollow(self):
+        self.assertTrue(self.john.follow(self.susan))
+        self.assertFalse(self.john.follow(self.susan))
+        self.assertEqual(self.counts(self.john), (0, 1))
+        self.assertEqual(self.counts(self.susan), (1, 0))
+        self.assertTrue(self.john.is_following(self.susan))
+        self.assertTrue(self.susan.is_followed_by(self.john))
+        self.assertFalse(self.susan.is_following(self.john))
+        self.assertTrue(self.john.unfollow(self.susan))
+        self.assertFalse(self.john.unfollow(self.susan))
+        self.assertEqual(self.counts(self.john), (0, 0))
+        self.assertEqual(self.counts(self.susan), (0, 0))
+        self.assertEqual(Follow.objects.count(), 0)
+
+    def test_following_ids(self):
+        self.john.follow(self.susan)
+        self.susan.follow(self.david)
+        ids = [self.susan.id, self.david.id, self.john.id]
+        self.assertEqual(self.john.following_ids(ids), set([self.susan.id]))
+        self.assertEqual(self.david.following_ids(ids), set())
+        self.assertEqual(self.john.following_ids([]), set())
+
+    def test_migrate_follow_lists(self):
+        users = User._get_collection()
+        # john follows susan and david; the arrays overlap on john->susan
+        users.update_one({'_id': self.john.id}, {'$set': {
+            'followed': [str(self.susan.id), str(self.david.id)]}})
+        users.update_one({'_id': self.susan.id}, {'$set': {
+            'followers': [str(self.john.id)], 'followed': [str(self.david.id)]}})
+        # documents still carrying the arrays load
+        self.assertEqual(User.objects(id=self.susan.id).first().username,
+                         'susan')
+        self.assertEqual(User.migrate_follow_lists(), 3)
+        self.assertEqual(
+            sorted((f.follower, f.followed) for f in Follow.objects),
+            sorted([(self.john.id, self.susan.id), (self.john.id, self.david.id),
+                    (self.susan.id, self.david.id)]))
+        self.assertEqual(self.counts(self.john), (0, 2))
+        self.assertEqual(self.counts(self.susan), (1, 1))
+        self.assertEqual(self.counts(self.david), (2, 0))
+        self.assertEqual(users.count_documents(
+            {'$or': [{'followers': {'$exists': True}},
+                     {'followed': {'$exists': True}}]}), 0)
+        self.assertEqual(User.migrate_follow_lists(), 0)
+        self.assertEqual(Follow.objects.count(), 3)
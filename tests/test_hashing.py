@@ -0,0 +1,50 @@
+import multiprocessing
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+try:
+    from queue import Full
+except ImportError:
+    from Queue import Full
+from werkzeug.security import generate_password_hash
+from app import create_app
+from app.hashing import PasswordHasher
+
+
+class PasswordHasherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        self.hasher = PasswordHasher(self.app)
+
+    def test_same_method_needs_no_rehash(self):
+        self.assertFalse(self.hasher.needs_rehash(self.hasher.hash('cat')))
+
+    def test_method_without_iterations_needs_no_rehash(self):
+        # werkzeug writes its default iteration count into the hash
+        self.hasher.method = 'pbkdf2:sha256'
+        password_hash = self.hasher.hash('cat')
+        self.assertNotEqual(password_hash.split('$', 1)[0], 'pbkdf2:sha256')
+        self.assertFalse(self.hasher.needs_rehash(password_hash))
+
+    def test_weaker_hashes_need_rehash(self):
+        self.assertTrue(self.hasher.needs_rehash(
+            generate_password_hash('cat', 'pbkdf2:sha256:500')))
+        self.assertTrue(self.hasher.needs_rehash(
+            generate_password_hash('cat', 'pbkdf2:sha1:1000')))
+        self.assertFalse(self.hasher.needs_rehash(
+            generate_password_hash('cat', 'pbkdf2:sha256:2000')))
+
+    def test_timed_out_hash_is_refused(self):
+        self.hasher.workers = 1
+        pool = mock.Mock()
+        pool.apply_async.return_value.get.side_effect = \
+            multiprocessing.TimeoutError()
+        with mock.patch.object(self.hasher, '_ensure_pool', return_value=pool):
+            with self.assertRaises(Full):
+                self.hasher.hash('cat')
+        pool.apply_async.return_value.get.assert_called_once_with(
+            self.hasher.result_timeout)
+        self.assertTrue(self.hasher._slots.empty())
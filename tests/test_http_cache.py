@@ -0,0 +1,48 @@
+import unittest
+from datetime import datetime, timedelta
+from werkzeug.http import http_date
+from app import create_app, last_seen
+from app.indexes import DOCUMENTS
+from app.models import Role, User
+
+
+class ProfileValidatorsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_RESPONSE_CACHE'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.john = self.add_user('john')
+        self.susan = self.add_user('susan')
+        # a copy fetched an hour ago
+        self.since = datetime.utcnow().replace(microsecond=0) - timedelta(hours=1)
+        User.objects(id=self.john.id).update_one(set__updated_at=self.since)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def add_user(self, username):
+        user = User(email='%s@example.com' % username, username=username)
+        user.password = 'cat'
+        user.save()
+        return user
+
+    def get(self):
+        return self.client.get('/user/john', headers={
+            'If-Modified-Since': http_date(self.since)}).status_code
+
+    def test_unchanged(self):
+        self.assertEqual(self.get(), 304)
+
+    def test_new_follower(self):
+        self.susan.follow(self.john)
+        self.assertEqual(self.get(), 200)
+
+    def test_last_seen(self):
+        last_seen.touch(self.john.id)
+        last_seen.flush()
+        self.assertEqual(self.get(), 200)
@@ -0,0 +1,123 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app import create_app
+from app.indexes import DOCUMENTS
+from app.models import Role, User, Post
+from app.pagination import CursorPagination, InvalidCursor, encode_cursor, \
+    decode_cursor, lookup_count, remember_count, _counts
+
+
+class CursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        value = datetime(2017, 3, 1, 12, 30, 5, 123456)
+        id = ObjectId()
+        self.assertEqual(decode_cursor(encode_cursor(value, id)), (value, id))
+
+    def test_before_epoch(self):
+        value = datetime(1969, 12, 31, 23, 59, 59, 1000)
+        id = ObjectId()
+        self.assertEqual(decode_cursor(encode_cursor(value, id)), (value, id))
+
+    def test_invalid(self):
+        for cursor in ('', 'not a cursor', 'MTIzOmZvbw'):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+
+class CursorPaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.author = User(email='author@example.com', username='author')
+        self.author.password = 'cat'
+        self.author.save()
+        start = datetime(2017, 1, 1)
+        # pairs of posts share a timestamp, so pages split ties
+        self.posts = []
+        for i in range(9):
+            post = Post(body='post %d' % i, author=self.author,
+                        timestamp=start + timedelta(minutes=i // 2))
+            post.save()
+            self.posts.append(post.id)
+        self.posts.reverse()
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def page(self, per_page, **kwargs):
+        return CursorPagination(Post.objects, per_page, **kwargs)
+
+    def ids(self, pagination):
+        return [p.id for p in pagination.items]
+
+    def test_newest_first(self):
+        pagination = self.page(4)
+        self.assertEqual(self.ids(pagination), self.posts[:4])
+        self.assertFalse(pagination.has_prev)
+        self.assertTrue(pagination.has_next)
+        self.assertIsNone(pagination.prev_cursor)
+
+    def test_forward_and_back(self):
+        pages = [self.page(4)]
+        while pages[-1].has_next:
+            pages.append(self.page(4, before=pages[-1].next_cursor))
+        self.assertEqual([self.ids(p) for p in pages],
+                         [self.posts[0:4], self.posts[4:8], self.posts[8:]])
+        self.assertIsNone(pages[-1].next_cursor)
+        back = self.page(4, after=pages[-1].prev_cursor)
+        self.assertEqual(self.ids(back), self.posts[4:8])
+        self.assertTrue(back.has_prev)
+        back = self.page(4, after=back.prev_cursor)
+        self.assertEqual(self.ids(back), self.posts[0:4])
+        self.assertFalse(back.has_prev)
+
+    def test_exact_multiple(self):
+        pagination = self.page(3, before=self.page(6).next_cursor)
+        self.assertEqual(self.ids(pagination), self.posts[6:9])
+        self.assertFalse(pagination.has_next)
+        pagination = self.page(9)
+        self.assertFalse(pagination.has_next)
+
+    def test_past_the_end(self):
+        last = self.page(9)
+        pagination = self.page(4, before=last._cursor(last.items[-1]))
+        self.assertEqual(pagination.items, [])
+        self.assertFalse(pagination.has_next)
+
+    def test_invalid_cursor(self):
+        response = self.app.test_client().get('/?before=bogus')
+        self.assertEqual(response.status_code, 400)
+
+
+class CountCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        _counts.clear()
+
+    def tearDown(self):
+        _counts.clear()
+        self.app_context.pop()
+
+    def test_remember(self):
+        self.assertIsNone(lookup_count('posts:john'))
+        remember_count('posts:john', 0)
+        self.assertEqual(lookup_count('posts:john'), 0)
+
+    def test_expiry(self):
+        remember_count('posts:john', 3, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(lookup_count('posts:john'))
+
+    def test_bounded(self):
+        for i in range(_counts.maxsize + 10):
+            remember_count('posts:user%d' % i, i)
+        self.assertEqual(len(_counts), _counts.maxsize)
+        self.assertIsNone(lookup_count('posts:user0'))
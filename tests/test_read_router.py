@@ -0,0 +1,99 @@
+import time
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from flask import session
+from mongoengine import QuerySet
+from app import create_app, read_router, response_cache
+from app.connection import SECONDARY
+from app.indexes import DOCUMENTS
+from app.models import Role, User, Post
+
+
+class ReadRouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        response_cache.backend.clear()
+        # mongomock has no replicas; pretend the secondary alias exists
+        read_router.secondary = True
+
+    def tearDown(self):
+        read_router.secondary = False
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def routed(self, path):
+        queryset = mock.Mock()
+        with self.app.test_request_context(path):
+            self.app.preprocess_request()
+            result = read_router.reads(queryset)
+        return result is queryset.using.return_value
+
+    def test_listings_read_from_the_secondary_for_anonymous_users(self):
+        # the index is cacheable for anonymous users, and still goes to
+        # the secondary
+        self.assertTrue(self.routed('/'))
+        self.assertTrue(self.routed('/user/john'))
+        self.assertTrue(self.routed('/followers/john'))
+
+    def test_other_endpoints_read_from_the_primary(self):
+        self.assertFalse(self.routed('/search?q=x'))
+        self.assertFalse(self.routed('/feed.atom'))
+
+    def test_own_writes_are_read_from_the_primary(self):
+        queryset = mock.Mock()
+        with self.app.test_request_context('/'):
+            read_router.stick_to_primary()
+            self.assertIs(read_router.reads(queryset), queryset)
+            session['_primary_until'] = time.time() - 1
+            self.assertIs(read_router.reads(queryset),
+                          queryset.using.return_value)
+        queryset.using.assert_called_once_with(SECONDARY)
+
+    def stored_ttls(self, client, url):
+        # the secondary reads are served by the default connection
+        with mock.patch.object(QuerySet, 'using', lambda self, alias: self), \
+                mock.patch.object(response_cache.backend, 'set',
+                                  wraps=response_cache.backend.set) as store:
+            self.assertEqual(client.get(url).status_code, 200)
+        ttls = {}
+        for call in store.call_args_list:
+            ttls.setdefault(call[0][0].split(':')[0], set()).add(call[0][2])
+        return ttls
+
+    def test_pages_read_from_the_secondary_expire_sooner(self):
+        self.add_post()
+        ttl = self.app.config['FLASKY_SECONDARY_CACHE_TTL']
+        self.assertEqual(self.stored_ttls(self.app.test_client(), '/'),
+                         {'page': set([ttl]), 'post': set([ttl])})
+
+    def test_fragments_for_signed_in_users_expire_sooner(self):
+        self.add_post()
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        client = self.app.test_client()
+        client.post('/auth/login', data={'email': 'john@example.com',
+                                         'password': 'cat'})
+        # the login itself keeps the session on the primary for a while
+        with client.session_transaction() as sess:
+            self.assertIn('_user_id', sess)
+            sess['_primary_until'] = 0
+        ttl = self.app.config['FLASKY_SECONDARY_CACHE_TTL']
+        self.assertEqual(self.stored_ttls(client, '/'), {'post': set([ttl])})
+
+    def test_fragments_read_from_the_primary_keep_the_full_ttl(self):
+        self.add_post()
+        read_router.secondary = False
+        ttls = self.stored_ttls(self.app.test_client(), '/')
+        self.assertEqual(ttls['post'], set([response_cache.ttl]))
+
+    def add_post(self):
+        user = User(email='john@example.com', username='john', confirmed=True)
+        user.password = 'cat'
+        user.save()
+        Post(body='hello', author=user).save()
@@ -0,0 +1,83 @@
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from app import create_app, response_cache
+from app.indexes import DOCUMENTS
+from app.models import Role, User, Post
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        response_cache.backend.clear()
+        self.author = self.add_user('john')
+        self.other = self.add_user('susan')
+        self.post = Post(body='hello', author=self.author)
+        self.post.save()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def add_user(self, username):
+        user = User(email='%s@example.com' % username, username=username)
+        user.password = 'cat'
+        user.save()
+        return user
+
+    def served_from_cache(self, url):
+        with mock.patch.object(response_cache, 'store',
+                               wraps=response_cache.store) as store:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return not store.called
+
+    def test_pages_are_cached(self):
+        for url in ('/', '/user/john', '/post/%s' % self.post.idx):
+            self.assertFalse(self.served_from_cache(url))
+            self.assertTrue(self.served_from_cache(url))
+
+    def test_unrelated_user_keeps_pages(self):
+        self.served_from_cache('/')
+        self.served_from_cache('/post/%s' % self.post.idx)
+        self.other.location = 'Paris'
+        self.other.save()
+        self.assertTrue(self.served_from_cache('/'))
+        self.assertTrue(self.served_from_cache('/post/%s' % self.post.idx))
+
+    def test_profile_change_keeps_post_pages(self):
+        self.served_from_cache('/post/%s' % self.post.idx)
+        self.author.about_me = 'Hi'
+        self.author.save()
+        self.assertTrue(self.served_from_cache('/post/%s' % self.post.idx))
+        self.assertFalse(self.served_from_cache('/user/john'))
+
+    def test_renamed_author_invalidates_pages(self):
+        self.served_from_cache('/')
+        self.served_from_cache('/post/%s' % self.post.idx)
+        self.author.username = 'johnny'
+        self.author.save()
+        response = self.client.get('/')
+        self.assertIn(b'johnny', response.data)
+        self.assertNotIn(b'/user/john"', response.data)
+        self.assertFalse(self.served_from_cache('/post/%s' % self.post.idx))
+
+    def test_scheme_is_part_of_the_key(self):
+        url = '/post/%s' % self.post.idx
+        self.served_from_cache(url)
+        response = self.client.get(url, base_url='https://localhost')
+        self.assertIn(b'https://secure.gravatar.com', response.data)
+        self.assertNotIn(b'http://www.gravatar.com', response.data)
+
+    def test_host_is_part_of_the_key(self):
+        for url in ('/feed.atom', '/user/john/feed.atom', '/api/v1/posts/'):
+            forged = self.client.get(url, headers={'Host': 'evil.example.com'})
+            self.assertIn(b'evil.example.com', forged.data)
+            response = self.client.get(url)
+            self.assertNotIn(b'evil.example.com', response.data)
@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app
+from app.indexes import DOCUMENTS
+from app.models import Role, User, Post
+from app.search import SearchTerm, SearchStats, index_post, rank, \
+    rebuild_index
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_SEARCH_POSTINGS'] = 1
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.john = User(email='john@example.com', username='john')
+        self.john.password = 'cat'
+        self.john.save()
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def add_post(self, body, age):
+        post = Post(body=body, author=self.john,
+                    timestamp=datetime.utcnow() - timedelta(hours=age))
+        post.save()
+        index_post(post)
+        return post
+
+    def statistics(self):
+        stats = SearchStats.objects.get(name='posts')
+        return (stats.docs, stats.length,
+                SearchTerm.objects.get(term='lorem').df)
+
+    def test_editing_an_evicted_post_keeps_statistics(self):
+        old = self.add_post('lorem ipsum', 2)
+        self.add_post('lorem dolor', 1)
+        # the old post's 'lorem' posting was evicted by the newer one
+        self.assertEqual([p['post'] for p in
+                          SearchTerm.objects.get(term='lorem').postings],
+                         [Post.objects(body='lorem dolor').first().id])
+        before = self.statistics()
+        self.assertEqual(before, (2, 6, 2))
+        for body in ('lorem ipsum', 'lorem ipsum sit'):
+            old.body = body
+            old.save()
+            index_post(old)
+        self.assertEqual(self.statistics(), (2, 7, 2))
+        self.assertEqual(SearchTerm.objects.get(term='ipsum').df, 1)
+        self.assertEqual(SearchTerm.objects.get(term='sit').df, 1)
+
+    def test_rebuild_matches_incremental_index(self):
+        old = self.add_post('lorem ipsum', 2)
+        self.add_post('lorem dolor', 1)
+        old.body = 'lorem amet'
+        old.save()
+        index_post(old)
+        incremental = self.statistics(), rank('lorem amet')
+        rebuild_index()
+        self.assertEqual((self.statistics(), rank('lorem amet')), incremental)
+        # entries written by the rebuild are taken back on the next edit
+        old.body = 'lorem'
+        old.save()
+        index_post(old)
+        self.assertEqual(self.statistics(), (2, 5, 2))
+        self.assertEqual(SearchTerm.objects.get(term='amet').df, 0)
@@ -0,0 +1,171 @@
+import unittest
+from datetime import datetime, timedelta
+from werkzeug.exceptions import BadRequest
+from app import create_app
+from app.indexes import DOCUMENTS
+from app.models import Role, User, Post, Follow
+from app.timeline import Timeline, TimelinePagination, fan_out, timeline_page
+
+
+class TimelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        # a third follower makes an author a celebrity
+        self.app.config['FLASKY_TIMELINE_FANOUT_LIMIT'] = 2
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        Role.insert_roles()
+        self.start = datetime(2017, 1, 1)
+        self.minutes = 0
+
+    def tearDown(self):
+        for document in DOCUMENTS:
+            document.drop_collection()
+        self.app_context.pop()
+
+    def add_user(self, username):
+        user = User(email='%s@example.com' % username, username=username)
+        user.password = 'cat'
+        user.save()
+        return user
+
+    def add_post(self, author, minutes=None):
+        if minutes is None:
+            self.minutes += 1
+            minutes = self.minutes
+        author.reload()
+        post = Post(body='post', author=author,
+                    timestamp=self.start + timedelta(minutes=minutes))
+        post.save()
+        fan_out(post)
+        return post
+
+    def follow(self, reader, author):
+        author.reload()
+        return reader.follow(author)
+
+    def unfollow(self, reader, author):
+        author.reload()
+        return reader.unfollow(author)
+
+    def stored(self, reader):
+        timeline = Timeline.objects(owner=reader.id).first()
+        return [e['post'] for e in timeline.entries] if timeline else []
+
+    def flags(self, author):
+        return sorted(bool(f.celebrity) for f in Follow.objects(followed=author.id))
+
+    def feed(self, reader, per_page=100, **kwargs):
+        return [p.id for p in TimelinePagination(reader, per_page, **kwargs).items]
+
+    def test_fan_out_reaches_followers_and_author(self):
+        john, susan, david = [self.add_user(n) for n in ('john', 'susan', 'david')]
+        self.follow(susan, john)
+        post = self.add_post(john)
+        self.assertEqual(self.stored(john), [post.id])
+        self.assertEqual(self.stored(susan), [post.id])
+        self.assertEqual(self.stored(david), [])
+
+    def test_follow_merges_recent_posts(self):
+        john, susan = self.add_user('john'), self.add_user('susan')
+        older = self.add_post(john)
+        newer = self.add_post(john)
+        self.follow(susan, john)
+        self.assertEqual(self.stored(susan), [newer.id, older.id])
+        self.assertEqual(self.feed(susan), [newer.id, older.id])
+
+    def test_unfollow_drops_posts(self):
+        john, susan = self.add_user('john'), self.add_user('susan')
+        mine = self.add_post(susan)
+        self.follow(susan, john)
+        self.add_post(john)
+        self.unfollow(susan, john)
+        self.assertEqual(self.stored(susan), [mine.id])
+
+    def test_celebrity_posts_are_merged_at_read_time(self):
+        star = self.add_user('star')
+        readers = [self.add_user('reader%d' % n) for n in range(3)]
+        for reader in readers[:2]:
+            self.follow(reader, star)
+        self.assertEqual(self.flags(star), [False, False])
+        self.follow(readers[2], star)
+        self.assertEqual(self.flags(star), [True, True, True])
+        post = self.add_post(star)
+        for reader in readers:
+            self.assertNotIn(post.id, self.stored(reader))
+            self.assertEqual(self.feed(reader), [post.id])
+
+    def test_unfollow_back_to_the_limit_resumes_fan_out(self):
+        star = self.add_user('star')
+        readers = [self.add_user('reader%d' % n) for n in range(3)]
+        for reader in readers:
+            self.follow(reader, star)
+        post = self.add_post(star)
+        self.unfollow(readers[0], star)
+        self.assertEqual(self.flags(star), [False, False])
+        # the remaining followers get the posts they merged until now
+        for reader in readers[1:]:
+            self.assertEqual(self.stored(reader), [post.id])
+            self.assertEqual(self.feed(reader), [post.id])
+        self.assertEqual(self.feed(readers[0]), [])
+        later = self.add_post(star)
+        self.assertEqual(self.stored(readers[1]), [later.id, post.id])
+
+    def test_unfollow_above_the_limit_keeps_flags(self):
+        star = self.add_user('star')
+        readers = [self.add_user('reader%d' % n) for n in range(4)]
+        for reader in readers:
+            self.follow(reader, star)
+        self.unfollow(readers[0], star)
+        self.assertEqual(self.flags(star), [True, True, True])
+
+    def make_feed(self):
+        # a fanned-out author and a celebrity posting in turn, with pairs
+        # of posts sharing a timestamp
+        reader = self.add_user('reader')
+        john, star = self.add_user('john'), self.add_user('star')
+        self.follow(reader, john)
+        for n in range(3):
+            self.follow(self.add_user('fan%d' % n), star)
+        self.follow(reader, star)
+        posts = []
+        for i in range(9):
+            posts.append(self.add_post((john, star)[i % 2], minutes=i // 2))
+        posts.sort(key=lambda p: (p.timestamp, p.id), reverse=True)
+        return reader, [p.id for p in posts]
+
+    def test_paging_forward_and_back(self):
+        reader, expected = self.make_feed()
+        self.assertEqual(self.feed(reader), expected)
+        pages = []
+        pagination = TimelinePagination(reader, 4)
+        self.assertFalse(pagination.has_prev)
+        while True:
+            pages.append([p.id for p in pagination.items])
+            if not pagination.has_next:
+                break
+            pagination = TimelinePagination(reader, 4,
+                                            before=pagination.next_cursor)
+        self.assertEqual(pages, [expected[:4], expected[4:8], expected[8:]])
+        self.assertTrue(pagination.has_prev)
+        back = TimelinePagination(reader, 4, after=pagination.prev_cursor)
+        self.assertEqual([p.id for p in back.items], expected[4:8])
+        self.assertTrue(back.has_prev)
+        self.assertTrue(back.has_next)
+        first = TimelinePagination(reader, 4, after=back.prev_cursor)
+        self.assertEqual([p.id for p in first.items], expected[:4])
+        self.assertFalse(first.has_prev)
+
+    def test_exact_multiple(self):
+        reader, expected = self.make_feed()
+        self.add_post(reader, minutes=-1)
+        pagination = TimelinePagination(reader, 5)
+        pagination = TimelinePagination(reader, 5, before=pagination.next_cursor)
+        self.assertEqual(len(pagination.items), 5)
+        self.assertFalse(pagination.has_next)
+
+    def test_invalid_cursor(self):
+        reader = self.add_user('reader')
+        with self.app.test_request_context('/?before=nonsense'):
+            with self.assertRaises(BadRequest):
+                timeline_page(reader, 4)